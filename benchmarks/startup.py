@@ -0,0 +1,49 @@
+# -*- coding: utf8 -*-
+"""
+Measures startup time of sqlibrist command line, i.e. time, spent before
+command does any work. Run from sqlibrist project directory::
+
+    python benchmarks/startup.py -n 20
+"""
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+import time
+
+COMMANDS = (
+    ('info', ['info']),
+    ('status -h', ['status', '-h']),
+)
+
+
+def run(arguments, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.time()
+        subprocess.call([sys.executable, '-c',
+                         'from sqlibrist import main; main()'] + arguments,
+                        stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        timings.append(time.time() - started)
+    return sorted(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', '-n',
+                        help='Runs of each command, default is 10',
+                        type=int,
+                        default=10)
+    args = parser.parse_args()
+
+    for name, arguments in COMMANDS:
+        timings = run(arguments, max(1, args.repeat))
+        print('%-10s min %.1f ms, median %.1f ms' % (
+            name,
+            timings[0] * 1000,
+            timings[len(timings) // 2] * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -21,6 +21,9 @@ setup(
     author='Serj Zavadsky',
     author_email='fevral13@gmail.com',
     install_requires=['PyYAML'],
+    extras_require={
+        'async': ['asyncpg'],
+    },
     classifiers=[
         'Environment :: Web Environment',
         'Environment :: Console',
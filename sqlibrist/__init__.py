@@ -1,18 +1,24 @@
 # -*- coding: utf8 -*-
 VERSION = '0.1.10'
 
-from sqlibrist.helpers import SqlibristException, handle_exception, \
-    get_command_parser, LazyConfig
-
 
 def main():
-    parser = get_command_parser()
+    import sys
+    from sqlibrist.helpers import SqlibristException, handle_exception, \
+        get_command_parser, get_subcommand, LazyConfig, COMMANDS
+
+    # plugin commands are looked up only if no built-in command is requested
+    builtin_commands = set(name for name, _, _, _ in COMMANDS)
+    load_plugins = get_subcommand(sys.argv[1:]) not in builtin_commands
+
+    parser = get_command_parser(load_plugins=load_plugins)
     args = parser.parse_args()
     config = LazyConfig(args)
     try:
         args.func(args, config)
     except SqlibristException as e:
         handle_exception(e)
+        sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,503 @@
+# -*- coding: utf8 -*-
+"""
+Asynchronous API for applying and checking migrations from asyncio
+applications (Python 3.5+, PostgreSQL via asyncpg)::
+
+    from sqlibrist import api
+
+    config = api.get_config('production')
+    result = await api.migrate(config)
+
+Functions return results instead of printing and raise SqlibristException
+subclasses on errors. Migration files are read in default executor, so
+event loop is not blocked
+"""
+import asyncio
+import os
+import time
+from argparse import Namespace
+from collections import namedtuple
+
+from sqlibrist.engines import BaseEngine, MIGRATE_LOCK_ID, LOCK_POLL_INTERVAL, \
+    POSTGRESQL_PRIMARY_KEY, RELOAD_TABLE, get_postgresql_reload_statements
+from sqlibrist.helpers import LazyConfig, BadConfig, ApplyMigrationFailed, \
+    LockTimeout, MigrationChecksumMismatch, ENGINE_POSTGRESQL, PHASE_PRE, \
+    PHASE_POST, get_migrations_store, split_phases, parse_data_instruction, \
+    has_statements, get_checksum, join_blocks, split_autocommit_block
+
+Status = namedtuple('Status', 'applied pending partial up_to_date')
+MigrateResult = namedtuple('MigrateResult', 'applied pending')
+
+
+async def run_in_executor(function, *args):
+    """
+    Runs blocking function (i.e. reading migrations store) in default
+    executor
+    """
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, function, *args)
+
+
+class AsyncPostgresql(BaseEngine):
+    """
+    PostgreSQL engine on asyncpg. Methods, touching DB, are coroutines.
+    Registered hooks are called synchronously
+    """
+    transactional_ddl = True
+
+    async def get_connection(self):
+        if self.connection is None:
+            import asyncpg
+            self.connection = await asyncpg.connect(
+                database=self.config.get('name'),
+                user=self.config.get('user'),
+                host=self.config.get('host'),
+                password=self.config.get('password'),
+                port=self.config.get('port'),
+            )
+        return self.connection
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+            self.connection = None
+
+    def quote_name(self, name):
+        return '"%s"' % name.replace('"', '""')
+
+    async def fetch_column(self, query, default=None):
+        """
+        Returns first column of query result, or default if table does not
+        exist (created by initdb of older version)
+        """
+        import asyncpg
+
+        connection = await self.get_connection()
+        try:
+            return [row[0] for row in await connection.fetch(query)]
+        except asyncpg.UndefinedTableError:
+            if default is None:
+                raise BadConfig('Migrations table not found, run '
+                                '"sqlibrist initdb" first')
+            return default
+
+    async def get_applied_migrations(self):
+        return await self.fetch_column('SELECT migration '
+                                       'FROM sqlibrist.migrations '
+                                       'ORDER BY datetime;')
+
+    async def get_partial_migrations(self):
+        return await self.fetch_column('SELECT migration '
+                                       'FROM sqlibrist.migration_phases '
+                                       'ORDER BY datetime;', [])
+
+    async def get_interrupted_migrations(self):
+        return await self.fetch_column('SELECT migration '
+                                       'FROM sqlibrist.migration_progress;',
+                                       [])
+
+    async def forget_interrupted_migrations(self):
+        connection = await self.get_connection()
+        await connection.execute('DELETE FROM sqlibrist.migration_progress;')
+
+    async def get_fingerprint(self):
+        result = await self.fetch_column('SELECT value FROM sqlibrist.state '
+                                         'WHERE name = \'fingerprint\';', [])
+        return result and result[0] or None
+
+    async def set_fingerprint(self, fingerprint):
+        import asyncpg
+
+        connection = await self.get_connection()
+        try:
+            async with connection.transaction():
+                await connection.execute('DELETE FROM sqlibrist.state '
+                                         'WHERE name = \'fingerprint\';')
+                if fingerprint:
+                    await connection.execute(
+                        'INSERT INTO sqlibrist.state (name, value) '
+                        'VALUES (\'fingerprint\', $1);', fingerprint)
+        except asyncpg.UndefinedTableError:
+            pass
+
+    async def acquire_lock(self, timeout):
+        connection = await self.get_connection()
+        deadline = time.time() + timeout
+        while True:
+            acquired = await connection.fetchval(
+                'SELECT pg_try_advisory_lock($1);', MIGRATE_LOCK_ID)
+            if acquired or time.time() >= deadline:
+                return acquired
+            await asyncio.sleep(max(0, min(LOCK_POLL_INTERVAL,
+                                           deadline - time.time())))
+
+    async def release_lock(self):
+        connection = await self.get_connection()
+        await connection.execute('SELECT pg_advisory_unlock($1);',
+                                 MIGRATE_LOCK_ID)
+
+    async def execute_data(self, table, path, reload_data=False):
+        import csv
+        from sqlibrist.helpers import MigrationDirectory
+
+        connection = await self.get_connection()
+        store = self.store or MigrationDirectory()
+        data_file = await run_in_executor(store.open, path)
+        try:
+            header = (await run_in_executor(data_file.readline)).decode('utf8')
+            columns = [column.strip()
+                       for column in next(csv.reader([header]))]
+            key = []
+            if reload_data:
+                # see BaseEngine.reload_data
+                key = [row[0] for row in await connection.fetch(
+                    POSTGRESQL_PRIMARY_KEY.replace('%s', '$1'),
+                    self.quote_name(table))]
+                if not key or not set(key) <= set(columns):
+                    key = []
+                    await connection.execute('DELETE FROM %s;'
+                                             % self.quote_name(table))
+            if key:
+                await connection.execute(
+                    'CREATE TEMPORARY TABLE %s AS SELECT %s FROM %s '
+                    'LIMIT 0;' % (self.quote_name(RELOAD_TABLE),
+                                  ', '.join(self.quote_name(column)
+                                            for column in columns),
+                                  self.quote_name(table)))
+            result = await connection.copy_to_table(
+                RELOAD_TABLE if key else table,
+                source=data_file,
+                columns=columns,
+                format='csv')
+            if key:
+                for statement in get_postgresql_reload_statements(
+                        self.quote_name, table, columns, key):
+                    await connection.execute(statement)
+        finally:
+            data_file.close()
+        return int(result.split()[-1])
+
+    async def execute(self, migration, statement):
+        """
+        Executes single migration block, notifying hooks. Row count is not
+        reported for multi-statement blocks
+        """
+        connection = await self.get_connection()
+        self.call_hooks('before_statement',
+                        migration=migration,
+                        statement=statement)
+        started = time.time()
+        data_instruction = parse_data_instruction(statement)
+        try:
+            if data_instruction:
+                rowcount = await self.execute_data(*data_instruction)
+            else:
+                await connection.execute(statement)
+                rowcount = None
+        except Exception as e:
+            self.call_hooks('on_error',
+                            migration=migration,
+                            statement=statement,
+                            error=e)
+            raise
+        self.call_hooks('after_statement',
+                        migration=migration,
+                        statement=statement,
+                        duration=time.time() - started,
+                        rowcount=rowcount,
+                        lock_wait=None)
+        return rowcount
+
+    async def apply_migration(self, name, blocks, fake=False, phase=None):
+        """
+        Applies list of migration blocks in transaction, see
+        Postgresql.apply_migration for phases
+        """
+        import asyncpg
+
+        blocks = [block for block in blocks if has_statements(block)]
+        connection = await self.get_connection()
+        try:
+            async with connection.transaction():
+                self.call_hooks('before_migration',
+                                migration=name,
+                                direction='up')
+                started = time.time()
+                if not fake:
+                    for block in blocks:
+                        await self.execute(name, block)
+                await self.record_migration(name, phase)
+        except asyncpg.PostgresError as e:
+            raise ApplyMigrationFailed('Migration %s failed: %s' % (name, e))
+        self.call_hooks('after_migration',
+                        migration=name,
+                        direction='up',
+                        duration=time.time() - started,
+                        statements=len(blocks))
+
+    async def apply_migration_resumable(self, name, blocks, checksum,
+                                        phase=None, autocommit=()):
+        """
+        Applies migration block by block with checkpoints, see
+        Postgresql.apply_migration_resumable
+        """
+        import asyncpg
+
+        blocks = [(block, i in autocommit)
+                  for i, block in enumerate(blocks)
+                  if has_statements(block)]
+        connection = await self.get_connection()
+        progress = await connection.fetchrow(
+            'SELECT checksum, block FROM sqlibrist.migration_progress '
+            'WHERE migration = $1;', name)
+        if progress is None:
+            await connection.execute(
+                'INSERT INTO sqlibrist.migration_progress '
+                '(migration, checksum, block) VALUES ($1, $2, 0);',
+                name, checksum)
+            done = 0
+        elif progress[0] != checksum and progress[1] == 0:
+            # see Postgresql.apply_migration_resumable
+            await connection.execute(
+                'UPDATE sqlibrist.migration_progress '
+                'SET checksum = $1, datetime = CURRENT_TIMESTAMP '
+                'WHERE migration = $2;', checksum, name)
+            done = 0
+        elif progress[0] != checksum:
+            raise MigrationChecksumMismatch(
+                'Migration %s was partially applied, but its up.sql '
+                'has changed since - refusing to resume, apply it '
+                'again with restart_interrupted' % name)
+        else:
+            done = progress[1]
+
+        self.call_hooks('before_migration',
+                        migration=name,
+                        direction='up')
+        started = time.time()
+        try:
+            for i, (block, block_autocommit) in enumerate(blocks[done:],
+                                                         done + 1):
+                if block_autocommit:
+                    # connection without transaction is in autocommit mode
+                    for statement in split_autocommit_block(block):
+                        await self.execute(name, statement)
+                    await self.set_progress(name, i)
+                else:
+                    async with connection.transaction():
+                        await self.execute(name, block)
+                        await self.set_progress(name, i)
+            async with connection.transaction():
+                await self.record_migration(name, phase)
+                await connection.execute(
+                    'DELETE FROM sqlibrist.migration_progress '
+                    'WHERE migration = $1;', name)
+        except asyncpg.PostgresError as e:
+            raise ApplyMigrationFailed('Migration %s failed: %s' % (name, e))
+        self.call_hooks('after_migration',
+                        migration=name,
+                        direction='up',
+                        duration=time.time() - started,
+                        statements=len(blocks) - done)
+
+    async def set_progress(self, name, block):
+        connection = await self.get_connection()
+        await connection.execute(
+            'UPDATE sqlibrist.migration_progress '
+            'SET block = $1, datetime = CURRENT_TIMESTAMP '
+            'WHERE migration = $2;', block, name)
+
+    async def record_migration(self, name, phase=None):
+        """
+        Records applied migration or its phase, see
+        Postgresql.record_migration
+        """
+        connection = await self.get_connection()
+        if phase == PHASE_PRE:
+            await connection.execute(
+                'INSERT INTO sqlibrist.migration_phases '
+                '(migration, phase) VALUES ($1, $2);', name, phase)
+        elif phase == PHASE_POST:
+            # keeps position of pre-deploy phase in ledger
+            await connection.execute(
+                'INSERT INTO sqlibrist.migrations '
+                '(migration, datetime) '
+                'SELECT migration, datetime '
+                'FROM sqlibrist.migration_phases '
+                'WHERE migration = $1;', name)
+            await connection.execute(
+                'DELETE FROM sqlibrist.migration_phases '
+                'WHERE migration = $1;', name)
+        else:
+            await connection.execute(
+                'INSERT INTO sqlibrist.migrations '
+                '(migration) VALUES ($1);', name)
+
+
+ASYNC_ENGINES = {
+    ENGINE_POSTGRESQL: AsyncPostgresql,
+}
+
+
+def get_config(name=None, config_file=None):
+    """
+    Loads named config from config file, defaults are the same as of
+    command line
+    """
+    return LazyConfig(Namespace(
+        config=name or os.environ.get('SQLIBRIST_CONFIG', 'default'),
+        config_file=config_file or os.environ.get('SQLIBRIST_CONFIG_FILE',
+                                                  'sqlibrist.yaml')))
+
+
+def get_async_engine(config, connection=None):
+    """
+    config is LazyConfig or dict with the same keys
+    """
+    try:
+        engine_class = ASYNC_ENGINES[config.get('engine')]
+    except KeyError:
+        raise BadConfig('Async API supports only engines %s'
+                        % ', '.join(ASYNC_ENGINES))
+    return engine_class(config, connection)
+
+
+async def read_store(store=None):
+    """
+    Returns store (found like command line does, if not given), list of its
+    migrations and their fingerprint
+    """
+    store = store or await run_in_executor(get_migrations_store)
+    migrations = await run_in_executor(store.list)
+    fingerprint = await run_in_executor(store.get_fingerprint)
+    return store, migrations, fingerprint
+
+
+async def get_status(engine, migrations, fingerprint):
+    if await engine.get_fingerprint() == fingerprint:
+        return Status(migrations, [], [], True)
+
+    applied = set(await engine.get_applied_migrations())
+    partial = await engine.get_partial_migrations()
+    return Status([m for m in migrations if m in applied],
+                  [m for m in migrations if m not in applied],
+                  [m for m in migrations if m in partial],
+                  False)
+
+
+async def status(config, store=None, connection=None):
+    """
+    Returns Status of migrations in DB: lists of applied, pending and
+    partially applied migrations (the latter are pending too)
+    """
+    _, migrations, fingerprint = await read_store(store)
+    return await check_status(config, migrations, fingerprint, connection)
+
+
+async def check_status(config, migrations, fingerprint, connection=None):
+    engine = get_async_engine(config, connection)
+    try:
+        return await get_status(engine, migrations, fingerprint)
+    finally:
+        if connection is None:
+            await engine.close()
+
+
+async def status_many(configs, store=None, concurrency=10):
+    """
+    Checks status of many DBs concurrently, at most concurrency
+    connections at once. Returns list of Status or exception, raised for
+    corresponding config
+    """
+    # migrations are read and fingerprinted once for all DBs
+    _, migrations, fingerprint = await read_store(store)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def check(config):
+        async with semaphore:
+            return await check_status(config, migrations, fingerprint)
+
+    return await asyncio.gather(*[check(config) for config in configs],
+                                return_exceptions=True)
+
+
+async def migrate(config, store=None, connection=None, migration=None,
+                  phase=None, fake=False, lock_timeout=300.0, hooks=(),
+                  restart_interrupted=False):
+    """
+    Applies pending migrations up to given migration (all by default), or
+    only phase (see "migrate --phase") of them. Interrupted migrations are
+    resumed, or applied from the first block with restart_interrupted (see
+    "migrate --restart-interrupted"). Waits for concurrently
+    running migrate up to lock_timeout seconds. Returns MigrateResult with
+    lists of applied (including pre-deploy phase only) and still pending
+    migrations
+    """
+    engine = get_async_engine(config, connection)
+    engine.store, migrations, fingerprint = await read_store(store)
+    for hook in hooks:
+        engine.add_hook(hook)
+
+    try:
+        if await engine.get_fingerprint() == fingerprint:
+            return MigrateResult([], [])
+
+        if not await engine.acquire_lock(lock_timeout):
+            raise LockTimeout('Migrate lock was not released in %s seconds'
+                              % lock_timeout)
+        try:
+            current = await get_status(engine, migrations, fingerprint)
+            interrupted = await engine.get_interrupted_migrations()
+            if restart_interrupted and interrupted:
+                await engine.forget_interrupted_migrations()
+                interrupted = []
+            pending = list(current.pending)
+            applied = []
+            for migration_name in current.pending:
+                if migration_name in current.partial:
+                    migration_phase = PHASE_POST
+                    if phase == PHASE_PRE:
+                        continue
+                elif phase == PHASE_POST:
+                    continue
+                else:
+                    migration_phase = None
+                phases = split_phases(await run_in_executor(
+                    engine.store.read, migration_name, 'up.sql'))
+                if phase == PHASE_PRE \
+                        and any(block.phase == PHASE_POST
+                                for block in phases):
+                    migration_phase = PHASE_PRE
+                phases = [block for block in phases
+                          if migration_phase in (None, block.phase)]
+                blocks = [block.block for block in phases]
+                autocommit = [i for i, block in enumerate(phases)
+                              if block.autocommit]
+
+                if (autocommit or migration_name in interrupted) \
+                        and not fake:
+                    await engine.apply_migration_resumable(
+                        migration_name,
+                        blocks,
+                        get_checksum(join_blocks(blocks)),
+                        migration_phase,
+                        autocommit)
+                else:
+                    await engine.apply_migration(migration_name,
+                                                 blocks,
+                                                 fake,
+                                                 migration_phase)
+                applied.append(migration_name)
+                if migration_phase != PHASE_PRE:
+                    pending.remove(migration_name)
+                if migration and migration in (migration_name,
+                                               migration_name.split('-')[0]):
+                    break
+
+            await engine.set_fingerprint(None if pending else fingerprint)
+        finally:
+            await engine.release_lock()
+        return MigrateResult(applied, pending)
+    finally:
+        if connection is None:
+            await engine.close()
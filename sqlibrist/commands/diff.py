@@ -4,12 +4,12 @@ from __future__ import print_function
 import difflib
 
 from sqlibrist.helpers import get_last_schema, get_current_schema, \
-    compare_schemas
+    compare_schemas, get_migrations_store
 
 
 def diff(args, config, connection=None):
     verbose = args.verbose
-    last_schema = get_last_schema()
+    last_schema = get_last_schema(get_migrations_store(args))
 
     current_schema = get_current_schema()
 
@@ -0,0 +1,159 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import glob
+import json
+import os
+import re
+from argparse import Namespace
+from multiprocessing.pool import ThreadPool
+
+from sqlibrist.helpers import get_engine, get_last_schema, get_checksum, \
+    get_migrations_store, LazyConfig, BadConfig, SchemaDrift
+
+CATALOG_FILENAME = 'catalog.json'
+
+# object kinds, reported as extra when present in DB but absent in schema.
+# Constraints are mostly declared inline in tables, so they are not reported
+EXTRA_KINDS = ('tables', 'views', 'functions', 'indexes', 'triggers', 'types')
+KINDS = EXTRA_KINDS + ('constraints',)
+
+
+def get_catalog_hashes(snapshot):
+    """
+    Returns dict of "kind/name": hash of definition. Names of triggers,
+    constraints and (on MySQL) indexes are unique per table only, so
+    definitions of same-named objects are hashed together, in fixed order
+    """
+    definitions = {}
+    for kind, name, definition in snapshot:
+        normalized = re.sub(r'\s+', ' ', definition or '').strip()
+        definitions.setdefault('%s/%s' % (kind, name), []).append(normalized)
+    return dict((name, get_checksum('; '.join(sorted(objects))))
+                for name, objects in definitions.items())
+
+
+def get_object_name(item_name):
+    """
+    Schema item "views/reports/user_orders" describes DB object
+    "views/user_orders"
+    """
+    parts = item_name.split('/')
+    return '%s/%s' % (parts[0], parts[-1])
+
+
+def get_baseline_filename():
+    migrations = sorted(glob.glob('migrations/*'))
+    if not migrations:
+        raise BadConfig('No migrations found')
+    return os.path.join(migrations[-1], CATALOG_FILENAME)
+
+
+def load_baseline(store):
+    migrations = store.list()
+    try:
+        return json.loads(store.read(migrations[-1], CATALOG_FILENAME))
+    except (IndexError, IOError):
+        return None
+
+
+def check_drift(schema, baseline, hashes):
+    objects = dict((get_object_name(name), name)
+                   for name in schema
+                   if name.split('/')[0] in KINDS)
+    report = {'missing': [], 'extra': [], 'changed': [], 'stale': []}
+
+    report['missing'] = sorted(name for name in objects
+                               if name not in hashes)
+
+    if baseline is None:
+        report['extra'] = sorted(name for name in hashes
+                                 if name.split('/')[0] in EXTRA_KINDS
+                                 and name not in objects)
+    else:
+        recorded = baseline['objects']
+        report['missing'] = sorted(set(report['missing']).union(
+            name for name in recorded if name not in hashes))
+        report['extra'] = sorted(name for name in hashes
+                                 if name not in recorded)
+        report['changed'] = sorted(name for name in hashes
+                                   if name in recorded
+                                   and recorded[name] != hashes[name])
+        report['stale'] = sorted(
+            name for name in schema
+            if baseline['items'].get(name) != schema[name]['hash'])
+    return report
+
+
+def get_configs(args, config, connection):
+    if not args.configs:
+        return [(args.config, config, connection)]
+    return [(name,
+             LazyConfig(Namespace(config_file=args.config_file, config=name)),
+             None)
+            for name in args.configs]
+
+
+def take_snapshot(config_info):
+    name, config, connection = config_info
+    try:
+        engine = get_engine(config, connection)
+        hashes = get_catalog_hashes(engine.get_catalog_snapshot())
+        if connection is None:
+            engine.get_connection().close()
+    except Exception as e:
+        return name, None, str(e)
+    return name, hashes, None
+
+
+def drift(args, config, connection=None):
+    configs = get_configs(args, config, connection)
+    pool = ThreadPool(max(1, min(args.jobs, len(configs))))
+    try:
+        snapshots = pool.map(take_snapshot, configs)
+    finally:
+        pool.close()
+
+    if args.record:
+        name, hashes, error = snapshots[0]
+        if error:
+            raise BadConfig(error)
+        schema = get_last_schema()
+        filename = get_baseline_filename()
+        with open(filename, 'w') as f:
+            f.write(json.dumps({
+                'items': dict((item, schema[item]['hash'])
+                              for item in schema),
+                'objects': hashes,
+            }, indent=2, sort_keys=True))
+        print('Catalog snapshot of %s saved to %s' % (name, filename))
+        return
+
+    store = get_migrations_store(args)
+    schema = get_last_schema(store)
+    baseline = load_baseline(store)
+
+    reports = {}
+    for name, hashes, error in snapshots:
+        if error:
+            reports[name] = {'error': error}
+        else:
+            reports[name] = check_drift(schema, baseline, hashes)
+
+    if args.json:
+        print(json.dumps(reports, indent=2, sort_keys=True))
+    else:
+        for name in sorted(reports):
+            report = reports[name]
+            if 'error' in report:
+                print('%s: error: %s' % (name, report['error']))
+            elif any(report.values()):
+                print('%s: drift detected' % name)
+                for key in ('missing', 'extra', 'changed', 'stale'):
+                    for item in report[key]:
+                        print('  %s: %s' % (key, item))
+            else:
+                print('%s: no drift' % name)
+
+    if any(any(report.values()) for report in reports.values()):
+        raise SchemaDrift(reports)
@@ -0,0 +1,273 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import json
+import re
+
+from sqlibrist.helpers import get_engine, get_migrations_store, \
+    ENGINE_POSTGRESQL, ENGINE_MYSQL
+from sqlibrist.commands.lint import get_statements, lint_statements, \
+    normalize, get_table, NAME, ALTER_TABLE
+from sqlibrist.commands.migrate import unapplied_migrations
+
+# weakest first, PostgreSQL and MySQL levels
+LOCK_LEVELS = ('NONE', 'EXPLICIT', 'ROW EXCLUSIVE', 'SHARED WRITE',
+               'SHARE UPDATE EXCLUSIVE', 'SHARED', 'SHARE',
+               'SHARE ROW EXCLUSIVE', 'EXCLUSIVE', 'ACCESS EXCLUSIVE')
+SIZES = ('rewrite', 'index_build', 'scan')
+
+NO_WHERE = r'(?!.*\bWHERE\b)'
+CREATE_OBJECT = (r'^CREATE (?:OR REPLACE )?(?:TEMP(?:ORARY)? |UNLOGGED )?'
+                 r'(?:TABLE|SCHEMA|SEQUENCE|FUNCTION|PROCEDURE|TYPE|DOMAIN|'
+                 r'EXTENSION|MATERIALIZED VIEW|VIEW)\b')
+
+
+class Statement(object):
+    """
+    Default lock of statements, matching pattern, and estimated work:
+    rewrite is "table" for statements, writing every row of table, and
+    "all" for ones, rewriting its indexes too. Pattern may capture affected
+    table as "table" group
+    """
+    def __init__(self, pattern, lock, rewrite=None, index_build=False):
+        self.pattern = re.compile(pattern, re.I)
+        self.lock = lock
+        self.rewrite = rewrite
+        self.index_build = index_build
+
+
+# first match wins. Objects, created by migration, are not locked by
+# anyone else, so CREATE takes no lock (CREATE OR REPLACE VIEW replaces
+# existing view, though)
+STATEMENTS = {
+    ENGINE_POSTGRESQL: (
+        Statement(r'^CREATE OR REPLACE VIEW ' + NAME, 'ACCESS EXCLUSIVE'),
+        Statement(r'^CREATE TABLE .* PARTITION OF ' + NAME,
+                  'ACCESS EXCLUSIVE'),
+        Statement(r'^CREATE (?:OR REPLACE )?(?:CONSTRAINT )?TRIGGER .* ON '
+                  + NAME,
+                  'SHARE ROW EXCLUSIVE'),
+        Statement(CREATE_OBJECT, 'NONE'),
+        Statement(r'^CREATE (?:UNIQUE )?INDEX CONCURRENTLY '
+                  r'(?:IF NOT EXISTS )?(?:\S+ )?ON (?:ONLY )?' + NAME,
+                  'SHARE UPDATE EXCLUSIVE', index_build=True),
+        Statement(r'^CREATE (?:UNIQUE )?INDEX (?:IF NOT EXISTS )?(?:\S+ )?'
+                  r'ON (?:ONLY )?' + NAME,
+                  'SHARE', index_build=True),
+        Statement(ALTER_TABLE, 'ACCESS EXCLUSIVE'),
+        Statement(r'^(?:ALTER|DROP) (?:MATERIALIZED )?VIEW '
+                  r'(?:IF EXISTS )?' + NAME,
+                  'ACCESS EXCLUSIVE'),
+        Statement(r'^(?:ALTER|DROP|REINDEX) INDEX\b', 'ACCESS EXCLUSIVE'),
+        Statement(r'^DROP TABLE (?:IF EXISTS )?' + NAME, 'ACCESS EXCLUSIVE'),
+        Statement(r'^TRUNCATE (?:TABLE )?(?:ONLY )?' + NAME,
+                  'ACCESS EXCLUSIVE'),
+        Statement(r'^UPDATE (?:ONLY )?' + NAME + NO_WHERE,
+                  'ROW EXCLUSIVE', rewrite='all'),
+        Statement(r'^DELETE FROM (?:ONLY )?' + NAME + NO_WHERE,
+                  'ROW EXCLUSIVE', rewrite='table'),
+        Statement(r'^(?:UPDATE (?:ONLY )?|DELETE FROM (?:ONLY )?|'
+                  r'INSERT INTO )' + NAME,
+                  'ROW EXCLUSIVE'),
+        # data loading blocks of data items
+        Statement(r'^--RELOAD ' + NAME, 'ROW EXCLUSIVE', rewrite='table'),
+        Statement(r'^--COPY ' + NAME, 'ROW EXCLUSIVE'),
+    ),
+    ENGINE_MYSQL: (
+        Statement(r'^CREATE OR REPLACE VIEW ' + NAME, 'EXCLUSIVE'),
+        Statement(CREATE_OBJECT, 'NONE'),
+        Statement(r'^CREATE (?:UNIQUE |FULLTEXT |SPATIAL )?INDEX \S+ ON '
+                  + NAME,
+                  'SHARED', index_build=True),
+        Statement(ALTER_TABLE, 'SHARED'),
+        Statement(r'^(?:ALTER|DROP) VIEW (?:IF EXISTS )?' + NAME,
+                  'EXCLUSIVE'),
+        Statement(r'^DROP INDEX \S+ ON ' + NAME, 'SHARED'),
+        Statement(r'^DROP TABLE (?:IF EXISTS )?' + NAME, 'EXCLUSIVE'),
+        Statement(r'^TRUNCATE (?:TABLE )?' + NAME, 'EXCLUSIVE'),
+        Statement(r'^UPDATE ' + NAME + NO_WHERE,
+                  'SHARED WRITE', rewrite='all'),
+        Statement(r'^DELETE FROM ' + NAME + NO_WHERE,
+                  'SHARED WRITE', rewrite='table'),
+        Statement(r'^(?:UPDATE |DELETE FROM |INSERT INTO )' + NAME,
+                  'SHARED WRITE'),
+        Statement(r'^--RELOAD ' + NAME, 'SHARED WRITE', rewrite='table'),
+        Statement(r'^--COPY ' + NAME, 'SHARED WRITE'),
+    ),
+}
+
+
+def get_relation_name(table, engine_name):
+    """
+    Unqualified name of table, as stored in catalog
+    """
+    name = re.search(r'(?:"[^"]+"|`[^`]+`|\w+)$', table).group(0)
+    if name[0] in '"`':
+        return name[1:-1]
+    return name.lower() if engine_name == ENGINE_POSTGRESQL else name
+
+
+def format_size(size):
+    if size < 1024:
+        return '%d B' % size
+    size = float(size)
+    for unit in ('kB', 'MB', 'GB'):
+        size /= 1024
+        if size < 1024:
+            break
+    else:
+        size /= 1024
+        unit = 'TB'
+    return '%.1f %s' % (size, unit)
+
+
+def get_strongest_lock(locks):
+    """
+    Returns strongest of known locks, or None
+    """
+    locks = [lock for lock in locks if lock in LOCK_LEVELS]
+    return locks and max(locks, key=LOCK_LEVELS.index) or None
+
+
+def classify(line, statement, findings, engine_name):
+    """
+    Returns dict with default lock of statement and flags of work, done by
+    it, raised by lint findings on the same line. Lock is None for
+    statements, that are not recognized
+    """
+    statement = normalize(statement)
+    result = {'line': line,
+              'statement': statement,
+              'table': None,
+              'lock': None,
+              'rewrite': None,
+              'index_build': False,
+              'scan': False,
+              'hazards': []}
+    for kind in STATEMENTS.get(engine_name, ()):
+        match = kind.pattern.search(statement)
+        if match:
+            result.update(table=get_table(match),
+                          lock=kind.lock,
+                          rewrite=kind.rewrite,
+                          index_build=kind.index_build)
+            break
+    for finding in findings:
+        rule = finding.rule
+        result['table'] = result['table'] or finding.table
+        result['lock'] = get_strongest_lock([result['lock'], rule.lock])
+        if rule.rewrite:
+            result['rewrite'] = 'all'
+        result['index_build'] = result['index_build'] or rule.index_build
+        result['scan'] = result['scan'] or rule.scan
+        result['hazards'].append('%s: %s' % (rule.severity, rule.message))
+    return result
+
+
+def estimate(statement, stats):
+    """
+    Estimates bytes, rewritten, read for index build and scanned by
+    classified statement
+    """
+    rows, table_size, index_size = stats or (None, 0, 0)
+    rewrite = statement.pop('rewrite')
+    statement.update(
+        rows=rows,
+        rewrite=(table_size + index_size if rewrite == 'all' else
+                 table_size if rewrite == 'table' else 0),
+        index_build=table_size if statement['index_build'] else 0,
+        scan=table_size if statement['scan'] else 0)
+    return statement
+
+
+def explain_migration(statements, stats, engine_name):
+    statements = [
+        estimate(statement,
+                 statement['table']
+                 and stats.get(get_relation_name(statement['table'],
+                                                 engine_name)))
+        for statement in statements]
+    total = dict((size, sum(statement[size] for statement in statements))
+                 for size in SIZES)
+    total['lock'] = get_strongest_lock(statement['lock']
+                                       for statement in statements)
+    return {'statements': statements, 'total': total}
+
+
+def classify_migration(store, migration, engine_name):
+    statements = get_statements(store.read(migration, 'up.sql'))
+    findings = lint_statements(statements, engine_name)
+    return [classify(line,
+                     statement,
+                     [finding for finding in findings
+                      if finding.line == line],
+                     engine_name)
+            for line, statement, _ in statements]
+
+
+def print_estimate(migration, estimate):
+    print('%s:' % migration)
+    for statement in estimate['statements']:
+        print('  up.sql:%s: %s' % (statement['line'],
+                                   statement['statement'][:100]))
+        if statement['lock'] is None:
+            parts = ['unknown lock']
+        elif statement['lock'] == 'NONE' and statement['table'] is None:
+            parts = ['no lock (new object)']
+        elif statement['table'] is None:
+            parts = ['%s lock' % statement['lock']]
+        else:
+            parts = ['%s lock on %s' % (statement['lock'],
+                                        statement['table'])]
+            if statement['rows'] is None:
+                parts[0] += ' (new table)'
+            else:
+                parts[0] += ' (~%s rows)' % statement['rows']
+        for size in SIZES:
+            if statement[size]:
+                parts.append('%s %s' % (size.replace('_', ' '),
+                                        format_size(statement[size])))
+        print('    %s' % ', '.join(parts))
+        for hazard in statement['hazards']:
+            print('    %s' % hazard)
+
+    total = estimate['total']
+    if total['lock'] in (None, 'NONE'):
+        print('  total: no locks on existing objects')
+    else:
+        print('  total: %s lock, %s' % (total['lock'], ', '.join(
+            '%s %s' % (size.replace('_', ' '), format_size(total[size]))
+            for size in SIZES)))
+
+
+def explain(args, config, connection=None):
+    engine = get_engine(config, connection)
+    store = get_migrations_store(args)
+    engine_name = config.get('engine')
+
+    migrations = args.migrations
+    if not migrations:
+        migrations = unapplied_migrations(store.list(),
+                                          engine.get_applied_migrations())
+    statements = [(migration,
+                   classify_migration(store, migration, engine_name))
+                  for migration in migrations]
+
+    tables = set(get_relation_name(statement['table'], engine_name)
+                 for _, migration_statements in statements
+                 for statement in migration_statements
+                 if statement['table'])
+    stats = tables and engine.get_relation_stats(tables) or {}
+
+    estimates = [(migration, explain_migration(migration_statements,
+                                               stats,
+                                               engine_name))
+                 for migration, migration_statements in statements]
+
+    if args.json:
+        print(json.dumps(dict(estimates), indent=2, sort_keys=True))
+    elif not estimates:
+        print('No migrations to apply')
+    else:
+        for migration, migration_estimate in estimates:
+            print_estimate(migration, migration_estimate)
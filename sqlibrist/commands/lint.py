@@ -0,0 +1,317 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import re
+
+from sqlibrist.helpers import get_migrations_store, split_statements, \
+    split_phases, parse_data_instruction, BadConfig, LintFailed, \
+    ENGINE_POSTGRESQL, ENGINE_MYSQL
+
+SEVERITIES = ('info', 'warning', 'error')
+
+NAME = r'(?P<table>(?:"[^"]+"|`[^`]+`|\w+)(?:\.(?:"[^"]+"|`[^`]+`|\w+))?)'
+ALTER_TABLE = r'^ALTER TABLE (?:IF EXISTS )?(?:ONLY )?' + NAME
+VOLATILE_DEFAULT = (r'DEFAULT \(?(?:random|clock_timestamp|timeofday|'
+                    r'gen_random_uuid|uuid_generate_v\d|nextval)\s*\(')
+
+
+class Rule(object):
+    """
+    Lock and rewrite hazard of statements, matching pattern (and not
+    matching exclude). Pattern may capture affected table as "table" group.
+    scan is True, if statement reads the whole table without rewriting it,
+    index_build - if it builds index on the table. Rule with in_transaction
+    applies only to statements outside of autocommit blocks, with
+    in_autocommit - only to statements of autocommit blocks
+    """
+    def __init__(self, pattern, lock, rewrite, severity, message, suggestion,
+                 exclude=None, scan=False, index_build=False,
+                 in_transaction=False, in_autocommit=False):
+        self.pattern = re.compile(pattern, re.I)
+        self.exclude = exclude and re.compile(exclude, re.I)
+        self.lock = lock
+        self.rewrite = rewrite
+        self.scan = scan
+        self.index_build = index_build
+        self.in_transaction = in_transaction
+        self.in_autocommit = in_autocommit
+        self.severity = severity
+        self.message = message
+        self.suggestion = suggestion
+
+    def match(self, statement, autocommit=False):
+        if self.in_transaction and autocommit \
+                or self.in_autocommit and not autocommit:
+            return None
+        if self.exclude and self.exclude.search(statement):
+            return None
+        return self.pattern.search(statement)
+
+
+RULES = {
+    ENGINE_POSTGRESQL: (
+        Rule(ALTER_TABLE + r'.* ALTER (?:COLUMN )?\S+ (?:SET DATA )?TYPE ',
+             'ACCESS EXCLUSIVE', True, 'error',
+             'ALTER COLUMN TYPE rewrites table and its indexes',
+             'add new column, backfill it in batches and swap columns'),
+        Rule(ALTER_TABLE + r'.* ADD (?:COLUMN )?.*(?:\b(?:SMALL|BIG)?SERIAL\b|'
+             + VOLATILE_DEFAULT + r')',
+             'ACCESS EXCLUSIVE', True, 'error',
+             'ADD COLUMN with volatile default rewrites table',
+             'add column without default, set default separately and '
+             'backfill existing rows in batches'),
+        Rule(ALTER_TABLE + r'.* ADD (?:COLUMN )?(?!(?:CONSTRAINT|CHECK|FOREIGN|'
+             r'PRIMARY|UNIQUE|EXCLUDE)\b).*\bNOT NULL\b',
+             'ACCESS EXCLUSIVE', False, 'warning',
+             'ADD COLUMN NOT NULL without default fails on non-empty table',
+             'add nullable column, backfill it and add NOT NULL '
+             'constraint afterwards',
+             exclude=r'\bDEFAULT\b'),
+        Rule(ALTER_TABLE + r'.* ALTER (?:COLUMN )?\S+ SET NOT NULL',
+             'ACCESS EXCLUSIVE', False, 'warning',
+             'SET NOT NULL scans whole table under exclusive lock',
+             'add CHECK (column IS NOT NULL) NOT VALID constraint, '
+             'VALIDATE it in separate transaction, then SET NOT NULL',
+             scan=True),
+        Rule(ALTER_TABLE + r'.* ADD (?:CONSTRAINT \S+ )?(?:FOREIGN KEY|CHECK)\b',
+             'SHARE ROW EXCLUSIVE', False, 'warning',
+             'adding constraint validates all rows while holding lock',
+             'add constraint with NOT VALID and VALIDATE CONSTRAINT in '
+             'separate transaction',
+             exclude=r'\bNOT VALID\b',
+             scan=True),
+        Rule(ALTER_TABLE + r'.* ADD (?:CONSTRAINT \S+ )?(?:PRIMARY KEY|UNIQUE)\b',
+             'ACCESS EXCLUSIVE', False, 'warning',
+             'adding primary key or unique constraint builds index under '
+             'exclusive lock',
+             'CREATE UNIQUE INDEX CONCURRENTLY, then ADD CONSTRAINT ... '
+             'USING INDEX',
+             exclude=r'\bUSING INDEX\b',
+             index_build=True),
+        Rule(ALTER_TABLE + r'.* SET (?:TABLESPACE|LOGGED|UNLOGGED)\b',
+             'ACCESS EXCLUSIVE', True, 'error',
+             'changing tablespace or logging rewrites table',
+             'schedule into maintenance window'),
+        Rule(r'^CREATE (?:UNIQUE )?INDEX (?!CONCURRENTLY\b)'
+             r'(?:IF NOT EXISTS )?(?:\S+ )?ON (?:ONLY )?' + NAME,
+             'SHARE', False, 'warning',
+             'CREATE INDEX blocks writes to table while index is built',
+             'build it CONCURRENTLY in autocommit post-deploy block '
+             '("--PHASE post autocommit")',
+             index_build=True),
+        Rule(r'^CREATE (?:UNIQUE )?INDEX CONCURRENTLY '
+             r'(?:IF NOT EXISTS )?(?:\S+ )?ON (?:ONLY )?' + NAME,
+             'SHARE UPDATE EXCLUSIVE', False, 'error',
+             'CREATE INDEX CONCURRENTLY can not run inside transaction block',
+             'move it into autocommit post-deploy block '
+             '("--PHASE post autocommit")',
+             index_build=True,
+             in_transaction=True),
+        Rule(r'^CREATE (?:UNIQUE )?INDEX CONCURRENTLY (?!IF NOT EXISTS\b)'
+             r'(?:\S+ )?ON (?:ONLY )?' + NAME,
+             'SHARE UPDATE EXCLUSIVE', False, 'warning',
+             'statement of autocommit block runs again, when interrupted '
+             'migration is resumed, and fails on existing index',
+             'use IF NOT EXISTS and drop invalid index, left by failed '
+             'build, before resuming',
+             index_build=True,
+             in_autocommit=True),
+        Rule(ALTER_TABLE + r'.* ADD CONSTRAINT \S+ .*\bUSING INDEX\b',
+             'ACCESS EXCLUSIVE', False, 'warning',
+             'statement of autocommit block runs again, when interrupted '
+             'migration is resumed, and fails on existing constraint',
+             'move it into following block without autocommit flag',
+             in_autocommit=True),
+        Rule(r'^VACUUM (?:\(.*\bFULL\b.*\)|FULL)\s*(?:\w+ )*' + NAME,
+             'ACCESS EXCLUSIVE', True, 'error',
+             'VACUUM FULL rewrites table under exclusive lock',
+             'use pg_repack or plain VACUUM'),
+        Rule(r'^CLUSTER\b(?: VERBOSE)?\s*' + NAME,
+             'ACCESS EXCLUSIVE', True, 'error',
+             'CLUSTER rewrites table under exclusive lock',
+             'use pg_repack'),
+        Rule(r'^REFRESH MATERIALIZED VIEW (?!CONCURRENTLY\b)' + NAME,
+             'ACCESS EXCLUSIVE', True, 'warning',
+             'REFRESH MATERIALIZED VIEW blocks reads of the view',
+             'create unique index on view and REFRESH ... CONCURRENTLY'),
+        Rule(r'^TRUNCATE (?:TABLE )?(?:ONLY )?' + NAME,
+             'ACCESS EXCLUSIVE', False, 'warning',
+             'TRUNCATE takes exclusive lock',
+             'DELETE in batches, if table is used concurrently'),
+        Rule(r'^LOCK (?:TABLE )?(?:ONLY )?' + NAME,
+             'EXPLICIT', False, 'info',
+             'explicit table lock',
+             'keep transaction short'),
+    ),
+    ENGINE_MYSQL: (
+        Rule(ALTER_TABLE + r'.* (?:MODIFY|CHANGE) (?:COLUMN )?',
+             'SHARED', True, 'error',
+             'changing column definition copies table',
+             'use online schema change tool (gh-ost, pt-online-schema-change)',
+             exclude=r'\bALGORITHM\s*=\s*(?:INSTANT|INPLACE)\b'),
+        Rule(ALTER_TABLE + r'.* (?:ENGINE\s*=|CONVERT TO CHARACTER SET|'
+             r'FORCE\b|(?:ADD|DROP) PRIMARY KEY)',
+             'SHARED', True, 'error',
+             'ALTER TABLE rebuilds table',
+             'use online schema change tool (gh-ost, pt-online-schema-change)'),
+        Rule(ALTER_TABLE + r'.* ADD (?:COLUMN )?(?!(?:UNIQUE|INDEX|KEY|'
+             r'FULLTEXT|SPATIAL|CONSTRAINT|PRIMARY|FOREIGN)\b)',
+             'NONE', False, 'info',
+             'ADD COLUMN may rebuild table on older servers',
+             'specify ALGORITHM=INSTANT to fail fast instead of rebuilding',
+             exclude=r'\bALGORITHM\s*=\s*INSTANT\b'),
+        Rule(r'^(?:' + ALTER_TABLE[1:] + r'.* ADD (?:UNIQUE |FULLTEXT |'
+             r'SPATIAL )?(?:INDEX|KEY)|CREATE (?:UNIQUE |FULLTEXT |SPATIAL )?'
+             r'INDEX \S+ ON ' + NAME.replace('table', 'index_table') + r')',
+             'SHARED', False, 'warning',
+             'index build may block writes',
+             'specify ALGORITHM=INPLACE, LOCK=NONE',
+             exclude=r'\bLOCK\s*=\s*NONE\b',
+             index_build=True),
+        Rule(r'^OPTIMIZE TABLE ' + NAME,
+             'SHARED', True, 'error',
+             'OPTIMIZE TABLE rebuilds table',
+             'schedule into maintenance window'),
+        Rule(r'^TRUNCATE (?:TABLE )?' + NAME,
+             'EXCLUSIVE', False, 'warning',
+             'TRUNCATE takes exclusive metadata lock',
+             'DELETE in batches, if table is used concurrently'),
+    ),
+}
+
+VIEW_DROP = re.compile(r'^DROP VIEW (?:IF EXISTS )?' + NAME, re.I)
+VIEW_CREATE = re.compile(r'^CREATE (?:OR REPLACE )?VIEW ' + NAME, re.I)
+
+
+class Finding(object):
+    def __init__(self, line, statement, rule, table=None):
+        self.line = line
+        self.statement = statement
+        self.rule = rule
+        self.table = table
+
+    def as_dict(self):
+        return {'line': self.line,
+                'statement': self.statement,
+                'lock': self.rule.lock,
+                'rewrite': self.rule.rewrite,
+                'scan': self.rule.scan,
+                'index_build': self.rule.index_build,
+                'severity': self.rule.severity,
+                'message': self.rule.message,
+                'suggestion': self.rule.suggestion,
+                'table': self.table}
+
+
+RECREATED_VIEW = Rule(r'$^', 'ACCESS EXCLUSIVE', False, 'warning',
+                      'view is dropped and created again, queries using it '
+                      'fail or wait in between',
+                      'use CREATE OR REPLACE VIEW, if columns are only added')
+
+
+def normalize(statement):
+    return re.sub(r'\s+', ' ', statement).strip()
+
+
+def get_table(match):
+    groups = match.groupdict()
+    return groups.get('table') or groups.get('index_table')
+
+
+def get_statements(sql):
+    """
+    Returns list of (line, statement, autocommit) of migration text, where
+    autocommit is True for statements of autocommit blocks. Data loading
+    block is returned as single statement
+    """
+    statements = []
+    for block in split_phases(sql):
+        if parse_data_instruction(block.block):
+            text = block.block.lstrip()
+            line = block.line + block.block[:-len(text)].count('\n')
+            statements.append((line, text.strip(), block.autocommit))
+            continue
+        for line, statement in split_statements(block.block):
+            statements.append((block.line + line - 1,
+                               statement,
+                               block.autocommit))
+    return statements
+
+
+def lint_statements(statements, engine_name):
+    """
+    Returns findings for list of (line, statement, autocommit)
+    """
+    rules = RULES.get(engine_name, ())
+    findings = []
+    dropped_views = {}
+    for line, statement, autocommit in statements:
+        statement = normalize(statement)
+        for rule in rules:
+            match = rule.match(statement, autocommit)
+            if match:
+                findings.append(Finding(line, statement, rule,
+                                        get_table(match)))
+                break
+
+        match = VIEW_DROP.search(statement)
+        if match:
+            dropped_views[match.group('table')] = line
+        match = VIEW_CREATE.search(statement)
+        if match and match.group('table') in dropped_views:
+            findings.append(Finding(dropped_views[match.group('table')],
+                                    statement, RECREATED_VIEW,
+                                    match.group('table')))
+    return findings
+
+
+def lint_migration(store, migration, engine_name):
+    return lint_statements(get_statements(store.read(migration, 'up.sql')),
+                           engine_name)
+
+
+def get_engine_name(args, config):
+    if args.engine:
+        return args.engine
+    try:
+        return config.get('engine') or ENGINE_POSTGRESQL
+    except BadConfig:
+        return ENGINE_POSTGRESQL
+
+
+def print_findings(migration, findings):
+    for finding in findings:
+        rule = finding.rule
+        print('%s/up.sql:%s: %s: %s (%s lock%s)' % (
+            migration, finding.line, rule.severity, rule.message, rule.lock,
+            ', table rewrite' if rule.rewrite else ''))
+        print('    %s' % finding.statement[:100])
+        print('    suggestion: %s' % rule.suggestion)
+
+
+def check_findings(findings, fail_on):
+    threshold = SEVERITIES.index(fail_on)
+    failed = [finding for finding in findings
+              if SEVERITIES.index(finding.rule.severity) >= threshold]
+    if failed:
+        raise LintFailed('%s statements with severity %s or higher'
+                         % (len(failed), fail_on))
+
+
+def lint(args, config, connection=None):
+    store = get_migrations_store(args)
+    engine_name = get_engine_name(args, config)
+
+    migrations = args.migrations
+    if not migrations:
+        migrations = store.list() if args.all else store.list()[-1:]
+
+    all_findings = []
+    for migration in migrations:
+        findings = lint_migration(store, migration, engine_name)
+        print_findings(migration, findings)
+        all_findings.extend(findings)
+
+    if not all_findings:
+        print('No hazards found')
+    check_findings(all_findings, args.fail_on)
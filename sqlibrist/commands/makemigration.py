@@ -2,7 +2,31 @@
 from __future__ import print_function
 
 from sqlibrist.helpers import get_last_schema, save_migration, \
-    get_current_schema, compare_schemas, mark_affected_items
+    get_current_schema, compare_schemas, mark_affected_items, \
+    get_next_migration_name, get_data_instruction, MigrationDirectory
+
+
+def prepare_data(current_schema, last_schema, migration_name):
+    """
+    Points items' data to CSV files in migrations. Unchanged data is kept in
+    previous migration, new and changed is copied to the new one. Returns
+    list of files to copy and names of items with changed data
+    """
+    data = []
+    changed = []
+    for name, item in current_schema.items():
+        if 'data' not in item:
+            continue
+        last_item = last_schema.get(name, {})
+        if last_item.get('data_hash') == item['data_hash']:
+            item['data'] = last_item['data']
+        else:
+            target = 'data/%s.csv' % name
+            data.append((item['data'], target))
+            item['data'] = '%s/%s' % (migration_name, target)
+            if name in last_schema:
+                changed.append(name)
+    return data, changed
 
 
 def makemigration(args, config, connection=None):
@@ -11,12 +35,17 @@ def makemigration(args, config, connection=None):
     migration_name = args.name
 
     current_schema = get_current_schema()
+    last_schema = get_last_schema() or {}
     execution_plan_up = []
     execution_plan_down = []
 
-    if not empty:
-        last_schema = get_last_schema() or {}
+    suffix = ('-%s' % (migration_name or ('manual' if empty else 'auto')))
+    new_migration_name = get_next_migration_name(suffix)
+    data, data_changed = prepare_data(current_schema,
+                                      last_schema,
+                                      new_migration_name)
 
+    if not empty:
         added, removed, changed = compare_schemas(last_schema, current_schema)
 
         added_items = sorted([current_schema[name] for name in added],
@@ -29,6 +58,8 @@ def makemigration(args, config, connection=None):
 
                 execution_plan_up.append(item['up'])
                 execution_plan_down.append(item['down'])
+                if 'data' in item:
+                    execution_plan_up.append(get_data_instruction(item))
 
         for name in changed:
             current_schema[name]['status'] = 'changed'
@@ -49,8 +80,13 @@ def makemigration(args, config, connection=None):
 
                 if item['name'] in last_schema \
                         and last_schema[item['name']]['down']:
-                    execution_plan_up.append(last_schema[item['name']]['down'])
-                    execution_plan_down.append(last_schema[item['name']]['up'])
+                    last_item = last_schema[item['name']]
+                    execution_plan_up.append(last_item['down'])
+                    # down plan is reversed, so data goes after table
+                    if 'data' in last_item:
+                        execution_plan_down.append(
+                            get_data_instruction(last_item))
+                    execution_plan_down.append(last_item['up'])
                 elif item['name'] not in last_schema and item['down']:
                     execution_plan_up.append(item['down'])
 
@@ -63,6 +99,24 @@ def makemigration(args, config, connection=None):
                     print('  %s' % item['name'])
                     execution_plan_up.append(item['up'])
                     execution_plan_down.append(item['down'])
+                    if 'data' in item:
+                        execution_plan_up.append(get_data_instruction(item))
+
+        recreated = set(item['name']
+                        for item in changed_items if item['down'])
+        reloaded_items = sorted([current_schema[name]
+                                 for name in data_changed
+                                 if name not in recreated],
+                                key=lambda i: i['degree'])
+        if reloaded_items:
+            print('Loading data:')
+            for item in reloaded_items:
+                print(' %s' % item['name'])
+                execution_plan_up.append(
+                    get_data_instruction(item, reload_data=True))
+                if 'data' in last_schema[item['name']]:
+                    execution_plan_down.append(get_data_instruction(
+                        last_schema[item['name']], reload_data=True))
 
         removed_items = sorted(
             [last_schema[name] for name in removed],
@@ -74,16 +128,23 @@ def makemigration(args, config, connection=None):
                 print(' %s' % item['name'])
 
                 execution_plan_up.append(item['down'])
-                execution_plan_down.append(last_schema[item['name']]['up'])
-
-        default_suffix = 'auto'
-    else:
-        default_suffix = 'manual'
-
-    suffix = ('-%s' % (migration_name or default_suffix))
+                if 'data' in item:
+                    execution_plan_down.append(get_data_instruction(item))
+                execution_plan_down.append(item['up'])
 
     if not dry_run:
         save_migration(current_schema,
                        execution_plan_up,
                        reversed(execution_plan_down),
-                       suffix)
+                       suffix,
+                       data)
+
+        if args.lint:
+            from sqlibrist.commands.lint import lint_migration, \
+                print_findings, check_findings, get_engine_name
+
+            findings = lint_migration(MigrationDirectory(),
+                                      new_migration_name,
+                                      get_engine_name(args, config))
+            print_findings(new_migration_name, findings)
+            check_findings(findings, args.fail_on)
@@ -1,11 +1,16 @@
 # -*- coding: utf8 -*-
 from __future__ import print_function
 
-import glob
-import os
+import sys
 
 from sqlibrist.helpers import get_engine, ApplyMigrationFailed, \
-    MigrationIrreversible
+    MigrationIrreversible, LockTimeout, get_checksum, get_migrations_store, \
+    split_phases, join_blocks, BadConfig, PHASE_PRE, PHASE_POST
+
+PHASE_NAMES = {
+    PHASE_PRE: 'pre-deploy',
+    PHASE_POST: 'post-deploy',
+}
 
 
 def unapplied_migrations(migration_list, applied_migrations):
@@ -14,66 +19,218 @@ def unapplied_migrations(migration_list, applied_migrations):
         try:
             ml.remove(migration[0])
         except ValueError:
+            # stderr keeps machine-readable output (explain --json) clean
             print('Miration "%s" is not in created '
                   'migration list, probably, this DB '
-                  'is from another branch' % migration[0])
+                  'is from another branch' % migration[0],
+                  file=sys.stderr)
     return ml
 
 
-def migrate(args, config, connection=None):
-    fake = args.fake
-    revert = args.revert
-    till_migration_name = args.migration
-    engine = get_engine(config, connection)
+def is_migration(migration_name, name):
+    """
+    Migration may be referenced by full name or by number
+    """
+    return name in (migration_name, migration_name.split('-')[0])
 
-    applied_migrations = engine.get_applied_migrations()
 
-    if applied_migrations and revert:
-        last_applied_migration = applied_migrations[-1][0]
+def get_revert_chain(applied_migrations, till_migration_name):
+    """
+    Returns applied migrations to revert, the latest first: the last one,
+    or all applied after given migration
+    """
+    if not till_migration_name:
+        return applied_migrations[-1:]
+    for i, migration_name in enumerate(applied_migrations):
+        if is_migration(migration_name, till_migration_name):
+            return applied_migrations[:i:-1]
+    raise BadConfig('Migration %s is not applied' % till_migration_name)
+
+
+def revert_migrations(engine, store, applied_migrations, till_migration_name,
+                      fake=False):
+    partial_migrations = engine.get_partial_migrations()
+    if partial_migrations:
+        raise MigrationIrreversible('Migrations %s are partially applied - '
+                                    'finish them with "migrate --phase post" '
+                                    'before reverting'
+                                    % ', '.join(partial_migrations))
+
+    chain = get_revert_chain(applied_migrations, till_migration_name)
+    if not chain:
+        print('No migrations to revert')
+        return
+
+    migrations = []
+    for migration_name in chain:
         try:
-            with open(os.path.join('migrations',
-                                   last_applied_migration,
-                                   'down.sql')) as f:
-                down = f.read()
+            down = store.read(migration_name, 'down.sql')
         except IOError:
             raise MigrationIrreversible('Migration %s does not '
                                         'have down.sql - reverting '
-                                        'impossible' % last_applied_migration)
+                                        'impossible' % migration_name)
+        migrations.append((migration_name, down))
 
-        print('Un-Applying migration %s... ' % last_applied_migration, end='')
-        if fake:
-            print('(fake run) ', end='')
-        try:
-            engine.unapply_migration(last_applied_migration, down, fake)
-        except ApplyMigrationFailed:
-            print('Error, rolled back')
-        else:
-            print('done')
+    print('Un-Applying migration%s %s... ' % ('s' if len(chain) > 1 else '',
+                                              ', '.join(chain)), end='')
+    if fake:
+        print('(fake run) ', end='')
+    try:
+        engine.unapply_migrations(migrations, fake)
+    except ApplyMigrationFailed as e:
+        # engines without transactional DDL revert migrations one by one
+        print('Error, %s' % (e.message or 'rolled back'))
+    else:
+        print('done')
+
+
+def migrate(args, config, connection=None):
+    engine = get_engine(config, connection)
+    store = get_migrations_store(args)
+    engine.store = store
+
+    if args.metrics_json:
+        from sqlibrist.hooks import JsonLinesExporter
+        engine.add_hook(JsonLinesExporter(args.metrics_json))
+    if args.metrics_prometheus:
+        from sqlibrist.hooks import PrometheusExporter
+        engine.add_hook(PrometheusExporter(args.metrics_prometheus))
+
+    monitor = None
+    if args.progress:
+        from sqlibrist.monitor import ProgressMonitor
+        monitor = ProgressMonitor(engine, args.progress_interval)
+        engine.add_hook(monitor)
+
+    # fingerprint of migrations is saved in DB after all of them are applied,
+    # so up-to-date DB is checked with single query
+    fingerprint = store.get_fingerprint()
+    if not args.revert and engine.get_fingerprint() == fingerprint:
+        print('No migrations to apply')
         return
 
+    # concurrently started migrates wait for the one, that applies
+    # migrations, and then find nothing to apply
+    if args.lock and not engine.acquire_lock(0):
+        print('Waiting for other migrate to finish...')
+        if not engine.acquire_lock(args.lock_timeout):
+            raise LockTimeout('Migrate lock was not released in %s seconds'
+                              % args.lock_timeout)
+
+    try:
+        if run_migrations(args, engine, store):
+            engine.set_fingerprint(fingerprint)
+        else:
+            engine.set_fingerprint(None)
+    finally:
+        if monitor is not None:
+            monitor.stop()
+        if args.lock:
+            engine.release_lock()
+
+
+def run_migrations(args, engine, store):
+    """
+    Applies or reverts migrations, returns True if all migrations in store
+    are applied
+    """
+    fake = args.fake
+    revert = args.revert
+    resumable = args.resumable
+    phase = args.phase
+    till_migration_name = args.migration
+
+    applied_migrations = engine.get_applied_migrations()
+
+    if applied_migrations and revert:
+        revert_migrations(engine,
+                          store,
+                          [m[0] for m in applied_migrations],
+                          till_migration_name,
+                          fake)
+        return False
+
     elif not revert:
-        migration_list = unapplied_migrations(
-            sorted(glob.glob('migrations/*')),
-            applied_migrations)
+        migration_list = unapplied_migrations(store.list(),
+                                              applied_migrations)
     else:
         # no migrations at all
-        migration_list = sorted(glob.glob('migrations/*'))
+        migration_list = store.list()
 
-    for migration in migration_list:
-        with open(os.path.join('migrations', migration, 'up.sql')) as f:
-            up = f.read()
+    # migrations with applied pre-deploy phase are finished by the post
+    # phase, pre phase skips them
+    partial_migrations = engine.get_partial_migrations()
+    # blocks of migration, interrupted in resumable mode, are already
+    # committed, so it is resumed even without --resumable
+    interrupted_migrations = engine.get_interrupted_migrations()
+    if args.restart_interrupted and interrupted_migrations:
+        print('Restarting interrupted migrations %s'
+              % ', '.join(interrupted_migrations))
+        if not fake:
+            engine.forget_interrupted_migrations()
+        interrupted_migrations = []
+    pending = list(migration_list)
+    if phase == PHASE_POST:
+        migration_list = [m for m in migration_list
+                          if m in partial_migrations]
+    elif phase == PHASE_PRE:
+        migration_list = [m for m in migration_list
+                          if m not in partial_migrations]
 
-        migration_name = migration.split('/')[-1]
-        print('Applying migration %s... ' % migration_name, end='')
+    if not migration_list:
+        print('No migrations to apply')
+
+    for migration_name in migration_list:
+        phases = split_phases(store.read(migration_name, 'up.sql'))
+        if migration_name in partial_migrations:
+            migration_phase = PHASE_POST
+        elif phase == PHASE_PRE \
+                and any(block.phase == PHASE_POST for block in phases):
+            migration_phase = PHASE_PRE
+        else:
+            migration_phase = None
+        phases = [block for block in phases
+                  if migration_phase in (None, block.phase)]
+        blocks = [block.block for block in phases]
+        # blocks, that can not run in transaction, are executed separately
+        # with checkpoints, as in resumable mode
+        autocommit = [i for i, block in enumerate(phases)
+                      if block.autocommit and engine.transactional_ddl]
+
+        resume = (resumable
+                  or migration_name in interrupted_migrations
+                  or autocommit) and not fake
+
+        print('Applying migration %s%s... ' % (
+            migration_name,
+            migration_phase and ' (%s)' % PHASE_NAMES[migration_phase] or ''),
+            end='')
         if fake:
             print('(fake run) ', end='')
         try:
-            engine.apply_migration(migration_name, up, fake)
+            if resume:
+                engine.apply_migration_resumable(
+                    migration_name,
+                    blocks,
+                    get_checksum(join_blocks(blocks)),
+                    migration_phase,
+                    autocommit)
+            else:
+                engine.apply_migration(migration_name,
+                                       join_blocks(blocks),
+                                       fake,
+                                       migration_phase)
         except ApplyMigrationFailed:
-            print('Error, rolled back')
-            break
+            if resume:
+                print('Error, stopped at failed block')
+            else:
+                print('Error, rolled back')
+            return False
         else:
             print('done')
+            if migration_phase != PHASE_PRE:
+                pending.remove(migration_name)
         if till_migration_name \
-                and migration_name == till_migration_name:
+                and is_migration(migration_name, till_migration_name):
             break
+    return not pending
@@ -0,0 +1,32 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import os
+import zipfile
+
+from sqlibrist.helpers import MigrationDirectory, get_migrations_fingerprint
+
+
+def pack(args, config, connection=None):
+    verbose = args.verbose
+    output = args.output
+    store = MigrationDirectory()
+
+    print('Packing migrations into %s...' % output)
+    temporary_output = '%s.tmp' % output
+    with zipfile.ZipFile(temporary_output, 'w', zipfile.ZIP_DEFLATED) as f:
+        for migration in store.list():
+            directory = os.path.join(store.path, migration)
+            # data/ subdirectory holds CSV files of data items
+            for root, dirs, filenames in os.walk(directory):
+                dirs.sort()
+                for filename in sorted(filenames):
+                    path = os.path.join(root, filename)
+                    f.write(path, '/'.join(
+                        [migration]
+                        + os.path.relpath(path, directory).split(os.sep)))
+            if verbose:
+                print('  %s' % migration)
+        f.comment = get_migrations_fingerprint(store).encode()
+    os.rename(temporary_output, output)
+    print('Done.')
@@ -0,0 +1,181 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import datetime
+import os
+import re
+
+from sqlibrist.helpers import get_engine, get_last_schema, \
+    get_current_schema, get_migrations_store, get_data_table, BadConfig
+
+INTERVALS = ('day', 'week', 'month', 'year')
+NAME_FORMATS = {
+    'day': '%Y%m%d',
+    'week': '%Y%m%d',
+    'month': '%Y%m',
+    'year': '%Y',
+}
+DEFAULT_PREMAKE = 4
+
+RANGE_BOUND = re.compile(r"^FOR VALUES FROM \('([^']+)'\) TO \('([^']+)'\)$")
+RANGE_KEY = re.compile(r'^RANGE \((.+)\)$')
+
+
+def get_partition_options(item):
+    """
+    Validates options of item's --PARTITION directive: key (column),
+    interval (day, week, month or year), premake (number of future
+    partitions) and retention (number of past intervals to keep, partitions
+    are never dropped if not given)
+    """
+    options = item['partition']
+    try:
+        key = options['key']
+    except KeyError:
+        raise BadConfig('Partition key of %s is not given' % item['name'])
+    interval = options.get('interval', 'month')
+    if interval not in INTERVALS:
+        raise BadConfig('Partition interval of %s must be one of %s'
+                        % (item['name'], ', '.join(INTERVALS)))
+    try:
+        premake = int(options.get('premake', DEFAULT_PREMAKE))
+        retention = options.get('retention')
+        retention = retention and int(retention)
+    except ValueError:
+        raise BadConfig('Partition premake and retention of %s must be '
+                        'numbers' % item['name'])
+    return {'key': key,
+            'interval': interval,
+            'premake': premake,
+            'retention': retention}
+
+
+def get_period_start(day, interval):
+    if interval == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    elif interval == 'month':
+        return day.replace(day=1)
+    elif interval == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+def add_intervals(day, interval, count):
+    if interval == 'day':
+        return day + datetime.timedelta(days=count)
+    elif interval == 'week':
+        return day + datetime.timedelta(weeks=count)
+    elif interval == 'year':
+        return day.replace(year=day.year + count)
+    months = day.year * 12 + day.month - 1 + count
+    return day.replace(year=months // 12, month=months % 12 + 1)
+
+
+def parse_bound(bound):
+    """
+    Returns (start, end) dates of range partition bound, or None for DEFAULT
+    and unbounded partitions
+    """
+    match = RANGE_BOUND.match(bound or '')
+    if match is None:
+        return None
+    try:
+        return tuple(datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+                     for value in match.groups())
+    except ValueError:
+        return None
+
+
+def plan_partitions(engine, table, options, partitions, today):
+    """
+    Returns statements, that create partitions for current and premake
+    future intervals and detach and drop partitions, that ended before
+    retention period
+    """
+    interval = options['interval']
+    quoted_table = engine.quote_name(table)
+    # DETACH CONCURRENTLY is not allowed, when table has DEFAULT partition
+    has_default = any(bound == 'DEFAULT' for _, bound in partitions)
+    bounds = [(name, parse_bound(bound)) for name, bound in partitions]
+    bounds = [(name, bound) for name, bound in bounds if bound]
+    current = get_period_start(today, interval)
+
+    statements = []
+    for i in range(options['premake'] + 1):
+        start = add_intervals(current, interval, i)
+        if any(bound[0] <= start < bound[1] for _, bound in bounds):
+            continue
+        end = add_intervals(start, interval, 1)
+        name = '%s_p%s' % (table, start.strftime(NAME_FORMATS[interval]))
+        # ATTACH takes weaker lock on parent than CREATE ... PARTITION OF
+        statements.append(
+            'CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS '
+            'INCLUDING CONSTRAINTS);' % (engine.quote_name(name),
+                                         quoted_table))
+        statements.append(
+            'ALTER TABLE %s ATTACH PARTITION %s '
+            'FOR VALUES FROM (\'%s\') TO (\'%s\');' % (
+                quoted_table, engine.quote_name(name), start, end))
+
+    if options['retention'] is not None:
+        cutoff = add_intervals(current, interval, -options['retention'])
+        for name, bound in bounds:
+            if bound[1] <= cutoff:
+                statements.append(
+                    'ALTER TABLE %s DETACH PARTITION %s%s;' % (
+                        quoted_table,
+                        engine.quote_name(name),
+                        '' if has_default else ' CONCURRENTLY'))
+                statements.append('DROP TABLE %s;' % engine.quote_name(name))
+    return statements
+
+
+def check_partition_key(table, options, key_definition):
+    if key_definition is None:
+        raise BadConfig('Table %s is not partitioned - apply its migration '
+                        'first' % table)
+    match = RANGE_KEY.match(key_definition)
+    if match is None or match.group(1).strip('"') != options['key']:
+        raise BadConfig('Table %s is partitioned by %s, not by RANGE (%s)'
+                        % (table, key_definition, options['key']))
+
+
+def partitions(args, config, connection=None):
+    verbose = args.verbose
+    dry_run = args.dry_run
+
+    engine = get_engine(config, connection)
+    # options may be changed without new migration, so they are read from
+    # schema files, unless only migrations are deployed
+    if os.path.isdir('schema'):
+        schema = get_current_schema()
+    else:
+        schema = get_last_schema(get_migrations_store(args))
+    items = dict((get_data_table(item), item)
+                 for item in schema.values()
+                 if 'partition' in item)
+    tables = args.tables or sorted(items)
+    for table in tables:
+        if table not in items:
+            raise BadConfig('Table %s does not have --PARTITION directive'
+                            % table)
+
+    today = datetime.date.today()
+    for table in tables:
+        options = get_partition_options(items[table])
+        key_definition, existing = engine.get_partitions(table)
+        check_partition_key(table, options, key_definition)
+
+        statements = plan_partitions(engine, table, options, existing, today)
+        if not statements:
+            print('Partitions of %s are up to date' % table)
+            continue
+
+        print('Partitions of %s:' % table)
+        for statement in statements:
+            print('  %s' % statement)
+        if dry_run:
+            continue
+        engine.execute_autocommit('partitions/%s' % table, statements)
+        if verbose:
+            print('Done.')
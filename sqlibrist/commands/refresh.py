@@ -0,0 +1,138 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import re
+import time
+from multiprocessing.pool import ThreadPool
+
+from sqlibrist.helpers import get_engine, get_last_schema, \
+    get_migrations_store, ApplyMigrationFailed, BadConfig
+
+MATERIALIZED_VIEW = re.compile(
+    r'\bCREATE\s+MATERIALIZED\s+VIEW\s+(?:IF\s+NOT\s+EXISTS\s+)?'
+    r'(?:\w+\.)?"?(\w+)"?', re.I)
+
+
+def get_materialized_views(schema):
+    """
+    Returns dict of item name: DB name of materialized view, created by item
+    """
+    views = {}
+    for name, item in schema.items():
+        match = MATERIALIZED_VIEW.search('\n'.join(item['up']))
+        if match:
+            views[name] = match.group(1)
+    return views
+
+
+def get_dependencies(schema, views, name):
+    """
+    Materialized views, which item depends on directly or through other
+    items
+    """
+    dependencies = set()
+    for requirement in schema[name]['requires']:
+        if requirement in views:
+            dependencies.add(requirement)
+        dependencies.update(get_dependencies(schema, views, requirement))
+    return dependencies
+
+
+def get_layers(dependencies):
+    """
+    Splits views into layers, each depending only on views of previous
+    layers
+    """
+    layers = []
+    done = set()
+    remaining = set(dependencies)
+    while remaining:
+        layer = sorted(name for name in remaining
+                       if dependencies[name] <= done)
+        layers.append(layer)
+        done.update(layer)
+        remaining.difference_update(layer)
+    return layers
+
+
+def select_views(views, dependencies, names):
+    """
+    Given views (by item or DB name) and views, depending on them
+    """
+    if not names:
+        return set(views)
+    db_names = dict((db_name, name) for name, db_name in views.items())
+    selected = set()
+    for name in names:
+        name = db_names.get(name, name)
+        if name not in views:
+            raise BadConfig('%s is not a materialized view' % name)
+        selected.add(name)
+    return selected.union(name for name in views
+                          if dependencies[name] & selected)
+
+
+def refresh_view(task):
+    engine, name, concurrently = task
+    statement = 'REFRESH MATERIALIZED VIEW %s%s;' % (
+        'CONCURRENTLY ' if concurrently else '', engine.quote_name(name))
+    started = time.time()
+    try:
+        engine.execute_autocommit('refresh/%s' % name, [statement])
+    except ApplyMigrationFailed:
+        return name, concurrently, time.time() - started, False
+    finally:
+        if engine.connection is not None:
+            engine.connection.close()
+    return name, concurrently, time.time() - started, True
+
+
+def refresh(args, config, connection=None):
+    dry_run = args.dry_run
+
+    engine = get_engine(config, connection)
+    schema = get_last_schema(get_migrations_store(args))
+    views = get_materialized_views(schema)
+    dependencies = dict((name, get_dependencies(schema, views, name))
+                        for name in views)
+    selected = select_views(views, dependencies, args.views)
+    layers = get_layers(dict((name, dependencies[name] & selected)
+                             for name in selected))
+    if not layers:
+        print('No materialized views to refresh')
+        return
+
+    # CONCURRENTLY needs unique index and fails on not populated view
+    info = engine.get_materialized_views([views[name] for name in selected])
+
+    pool = ThreadPool(max(1, args.jobs))
+    started = time.time()
+    try:
+        for i, layer in enumerate(layers, 1):
+            print('Layer %s: %s' % (i, ', '.join(layer)))
+            if dry_run:
+                continue
+            tasks = []
+            for name in layer:
+                populated, unique_index = info.get(views[name],
+                                                   (False, False))
+                tasks.append((engine.__class__(config),
+                              views[name],
+                              populated and unique_index))
+            failed = []
+            for view, concurrently, duration, success in \
+                    pool.imap_unordered(refresh_view, tasks):
+                print('  %s%s %s in %.2fs' % (
+                    view,
+                    ' (concurrently)' if concurrently else '',
+                    'refreshed' if success else 'failed',
+                    duration))
+                if not success:
+                    failed.append(view)
+            if failed:
+                # dependent views would be refreshed from stale data
+                raise ApplyMigrationFailed(failed)
+    finally:
+        pool.close()
+    if not dry_run:
+        print('Done in %.2fs' % (time.time() - started))
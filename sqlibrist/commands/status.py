@@ -1,9 +1,7 @@
 # -*- coding: utf8 -*-
 from __future__ import print_function
 
-import os
-
-from sqlibrist.helpers import get_engine
+from sqlibrist.helpers import get_engine, get_migrations_store
 
 
 def status(args, config, connection=None):
@@ -14,11 +12,20 @@ def status(args, config, connection=None):
     """
 
     engine = get_engine(config, connection)
+    store = get_migrations_store(args)
 
-    applied_migrations = {m[0] for m in engine.get_applied_migrations()}
-    all_migrations = sorted(os.listdir('migrations/'))
+    all_migrations = store.list()
+    if engine.get_fingerprint() == store.get_fingerprint():
+        applied_migrations = set(all_migrations)
+        partial_migrations = set()
+    else:
+        applied_migrations = {m[0] for m in engine.get_applied_migrations()}
+        partial_migrations = set(engine.get_partial_migrations())
     for i, migration in enumerate(all_migrations):
         if migration in applied_migrations:
             print('Migration %s - applied' % migration)
+        elif migration in partial_migrations:
+            print('Migration %s - partially applied, post-deploy phase '
+                  'pending' % migration)
         else:
             print('Migration %s - NOT applied' % migration)
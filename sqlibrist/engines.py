@@ -1,11 +1,420 @@
 # -*- coding: utf8 -*-
 from __future__ import absolute_import, print_function
 
+import os
+import time
+
+# single query, returning (kind, name, definition) for every schema object,
+# kinds named after directories in schema/
+# partitions are created by "partitions" command, not by migrations, so
+# they and objects, cloned to them from partitioned table, are skipped
+POSTGRESQL_CATALOG_SNAPSHOT = '''
+SELECT 'tables', c.relname,
+       string_agg(a.attname || ' ' || format_type(a.atttypid, a.atttypmod)
+                  || CASE WHEN a.attnotnull THEN ' NOT NULL' ELSE '' END
+                  || COALESCE(' DEFAULT ' || pg_get_expr(d.adbin, d.adrelid),
+                              ''),
+                  ', ' ORDER BY a.attnum)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+JOIN pg_attribute a ON a.attrelid = c.oid
+                   AND a.attnum > 0 AND NOT a.attisdropped
+LEFT JOIN pg_attrdef d ON d.adrelid = c.oid AND d.adnum = a.attnum
+WHERE c.relkind IN ('r', 'p') AND NOT c.relispartition
+  AND n.nspname = ANY(current_schemas(false))
+GROUP BY c.relname
+
+UNION ALL
+SELECT 'views', viewname, definition
+FROM pg_views
+WHERE schemaname = ANY(current_schemas(false))
+
+UNION ALL
+SELECT 'views', matviewname, definition
+FROM pg_matviews
+WHERE schemaname = ANY(current_schemas(false))
+
+UNION ALL
+SELECT 'functions', p.proname,
+       string_agg(pg_get_function_identity_arguments(p.oid) || ' '
+                  || pg_get_function_result(p.oid) || ' ' || p.prosrc,
+                  '; ' ORDER BY pg_get_function_identity_arguments(p.oid))
+FROM pg_proc p
+JOIN pg_namespace n ON n.oid = p.pronamespace
+WHERE n.nspname = ANY(current_schemas(false))
+  AND NOT EXISTS (SELECT 1 FROM pg_depend dep
+                  WHERE dep.objid = p.oid AND dep.deptype = 'e')
+GROUP BY p.proname
+
+UNION ALL
+SELECT 'indexes', c.relname, pg_get_indexdef(i.indexrelid)
+FROM pg_index i
+JOIN pg_class c ON c.oid = i.indexrelid
+JOIN pg_class tc ON tc.oid = i.indrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = ANY(current_schemas(false)) AND NOT tc.relispartition
+  AND NOT EXISTS (SELECT 1 FROM pg_constraint con
+                  WHERE con.conindid = i.indexrelid)
+
+UNION ALL
+SELECT 'triggers', t.tgname, pg_get_triggerdef(t.oid)
+FROM pg_trigger t
+JOIN pg_class c ON c.oid = t.tgrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE NOT t.tgisinternal AND NOT c.relispartition
+  AND n.nspname = ANY(current_schemas(false))
+
+UNION ALL
+SELECT 'constraints', con.conname, pg_get_constraintdef(con.oid)
+FROM pg_constraint con
+JOIN pg_namespace n ON n.oid = con.connamespace
+LEFT JOIN pg_class c ON c.oid = con.conrelid
+WHERE n.nspname = ANY(current_schemas(false))
+  AND NOT COALESCE(c.relispartition, false)
+
+UNION ALL
+SELECT 'types', t.typname,
+       t.typtype
+       || CASE WHEN t.typtype = 'd'
+               THEN ' ' || format_type(t.typbasetype, t.typtypmod)
+               ELSE '' END
+       || COALESCE((SELECT ' ' || string_agg(e.enumlabel, ','
+                                             ORDER BY e.enumsortorder)
+                    FROM pg_enum e WHERE e.enumtypid = t.oid), '')
+       || COALESCE((SELECT ' ' || string_agg(
+                        a.attname || ' ' || format_type(a.atttypid,
+                                                        a.atttypmod),
+                        ', ' ORDER BY a.attnum)
+                    FROM pg_attribute a
+                    WHERE a.attrelid = t.typrelid AND a.attnum > 0), '')
+FROM pg_type t
+JOIN pg_namespace n ON n.oid = t.typnamespace
+LEFT JOIN pg_class tc ON tc.oid = t.typrelid
+WHERE n.nspname = ANY(current_schemas(false))
+  AND (t.typtype IN ('e', 'd') OR (t.typtype = 'c' AND tc.relkind = 'c'))
+  AND NOT EXISTS (SELECT 1 FROM pg_depend dep
+                  WHERE dep.objid = t.oid AND dep.deptype = 'e');
+'''
+
+MYSQL_CATALOG_SNAPSHOT = '''
+SELECT 'tables', c.TABLE_NAME,
+       GROUP_CONCAT(CONCAT_WS(' ', c.COLUMN_NAME, c.COLUMN_TYPE,
+                              c.IS_NULLABLE, c.COLUMN_DEFAULT, c.EXTRA)
+                    ORDER BY c.ORDINAL_POSITION SEPARATOR ', ')
+FROM information_schema.COLUMNS c
+JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = c.TABLE_SCHEMA
+                                 AND t.TABLE_NAME = c.TABLE_NAME
+WHERE c.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+GROUP BY c.TABLE_NAME
+
+UNION ALL
+SELECT 'views', TABLE_NAME, VIEW_DEFINITION
+FROM information_schema.VIEWS
+WHERE TABLE_SCHEMA = DATABASE()
+
+UNION ALL
+SELECT 'functions', ROUTINE_NAME,
+       CONCAT_WS(' ', ROUTINE_TYPE, DTD_IDENTIFIER, ROUTINE_DEFINITION)
+FROM information_schema.ROUTINES
+WHERE ROUTINE_SCHEMA = DATABASE()
+
+UNION ALL
+SELECT 'indexes', INDEX_NAME,
+       GROUP_CONCAT(CONCAT_WS(' ', TABLE_NAME, NON_UNIQUE, COLUMN_NAME)
+                    ORDER BY SEQ_IN_INDEX SEPARATOR ', ')
+FROM information_schema.STATISTICS
+WHERE TABLE_SCHEMA = DATABASE() AND INDEX_NAME <> 'PRIMARY'
+GROUP BY TABLE_NAME, INDEX_NAME
+
+UNION ALL
+SELECT 'triggers', TRIGGER_NAME,
+       CONCAT_WS(' ', ACTION_TIMING, EVENT_MANIPULATION, EVENT_OBJECT_TABLE,
+                 ACTION_STATEMENT)
+FROM information_schema.TRIGGERS
+WHERE TRIGGER_SCHEMA = DATABASE()
+
+UNION ALL
+SELECT 'constraints', CONSTRAINT_NAME,
+       CONCAT_WS(' ', TABLE_NAME, CONSTRAINT_TYPE)
+FROM information_schema.TABLE_CONSTRAINTS
+WHERE CONSTRAINT_SCHEMA = DATABASE() AND CONSTRAINT_TYPE <> 'PRIMARY KEY';
+'''
+# advisory lock key, held by "migrate" while migrations are applied
+MIGRATE_LOCK_ID = 5947310413
+LOCK_POLL_INTERVAL = 0.5
+
+POSTGRESQL_ACTIVITY = '''
+SELECT a.state, a.wait_event_type, a.wait_event,
+       (SELECT array_agg(b.pid || ' ' || COALESCE(b.usename, '') || ' '
+                         || COALESCE(b.state, '') || ': '
+                         || left(b.query, 60))
+        FROM pg_stat_activity b
+        WHERE b.pid = ANY(pg_blocking_pids(a.pid)))
+FROM pg_stat_activity a
+WHERE a.pid = %s;
+'''
+
+POSTGRESQL_PROGRESS = '''
+SELECT a.state, a.wait_event_type, a.wait_event,
+       (SELECT array_agg(b.pid || ' ' || COALESCE(b.usename, '') || ' '
+                         || COALESCE(b.state, '') || ': '
+                         || left(b.query, 60))
+        FROM pg_stat_activity b
+        WHERE b.pid = ANY(pg_blocking_pids(a.pid))),
+       ci.phase, ci.blocks_done, ci.blocks_total,
+       ci.tuples_done, ci.tuples_total,
+       cl.phase, cl.heap_blks_scanned, cl.heap_blks_total
+FROM pg_stat_activity a
+LEFT JOIN pg_stat_progress_create_index ci ON ci.pid = a.pid
+LEFT JOIN pg_stat_progress_cluster cl ON cl.pid = a.pid
+WHERE a.pid = %s;
+'''
+
+MYSQL_PROGRESS = '''
+SELECT p.STATE, s.EVENT_NAME, s.WORK_COMPLETED, s.WORK_ESTIMATED,
+       (SELECT GROUP_CONCAT(w.blocking_pid)
+        FROM sys.schema_table_lock_waits w
+        WHERE w.waiting_pid = p.ID)
+FROM information_schema.PROCESSLIST p
+LEFT JOIN performance_schema.threads t ON t.PROCESSLIST_ID = p.ID
+LEFT JOIN performance_schema.events_stages_current s
+       ON s.THREAD_ID = t.THREAD_ID
+WHERE p.ID = %s;
+'''
+
+
+POSTGRESQL_PARTITION_KEY = '''
+SELECT pg_get_partkeydef(c.oid)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relname = %s AND c.relkind = 'p'
+  AND n.nspname = ANY(current_schemas(false))
+'''
+
+POSTGRESQL_PARTITIONS = '''
+SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+FROM pg_inherits i
+JOIN pg_class c ON c.oid = i.inhrelid
+JOIN pg_class p ON p.oid = i.inhparent
+JOIN pg_namespace n ON n.oid = p.relnamespace
+WHERE p.relname = %s AND n.nspname = ANY(current_schemas(false))
+ORDER BY c.relname
+'''
+
+POSTGRESQL_PRIMARY_KEY = '''
+SELECT a.attname
+FROM pg_index i
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+WHERE i.indrelid = %s::regclass AND i.indisprimary
+ORDER BY a.attnum
+'''
+
+MYSQL_PRIMARY_KEY = '''
+SELECT COLUMN_NAME
+FROM information_schema.KEY_COLUMN_USAGE
+WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s
+  AND CONSTRAINT_NAME = 'PRIMARY'
+ORDER BY ORDINAL_POSITION
+'''
+
+# temporary table, reloaded CSV data is loaded into
+RELOAD_TABLE = 'sqlibrist_reload'
+
+POSTGRESQL_RELATION_STATS = '''
+SELECT c.relname, c.reltuples::bigint, pg_table_size(c.oid),
+       pg_indexes_size(c.oid)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relname = ANY(%s) AND c.relkind IN ('r', 'p', 'm')
+  AND n.nspname = ANY(current_schemas(false))
+'''
+
+# CONCURRENTLY refresh requires unique index on plain columns without WHERE
+POSTGRESQL_MATERIALIZED_VIEWS = '''
+SELECT c.relname, c.relispopulated,
+       EXISTS (SELECT 1 FROM pg_index i
+               WHERE i.indrelid = c.oid AND i.indisunique
+                 AND i.indpred IS NULL AND i.indexprs IS NULL)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind = 'm' AND c.relname = ANY(%s)
+  AND n.nspname = ANY(current_schemas(false))
+'''
+
+
+def get_postgresql_reload_statements(quote_name, table, columns, key):
+    """
+    See BaseEngine.get_reload_statements, shared with async engine
+    """
+    table = quote_name(table)
+    reload_table = quote_name(RELOAD_TABLE)
+    names = ', '.join(quote_name(column) for column in columns)
+    updated = [column for column in columns if column not in key]
+    return [
+        'DELETE FROM %s t WHERE NOT EXISTS (SELECT 1 FROM %s r WHERE %s);' % (
+            table, reload_table, ' AND '.join(
+                'r.%s = t.%s' % (quote_name(column), quote_name(column))
+                for column in key)),
+        'INSERT INTO %s (%s) SELECT %s FROM %s ON CONFLICT (%s) %s;' % (
+            table, names, names, reload_table,
+            ', '.join(quote_name(column) for column in key),
+            'DO UPDATE SET %s' % ', '.join(
+                '%s = EXCLUDED.%s' % (quote_name(column), quote_name(column))
+                for column in updated) if updated else 'DO NOTHING'),
+        'DROP TABLE %s;' % reload_table,
+    ]
+
 
 class BaseEngine(object):
+    # DDL is rolled back with transaction, so migration blocks, that can
+    # not run in transaction, are executed separately, see
+    # apply_migration_resumable
+    transactional_ddl = False
+
     def __init__(self, config, connection=None):
         self.config = config
         self.connection = connection
+        self.hooks = []
+        # migrations store to read CSV data from, see execute_data()
+        self.store = None
+        # seconds, current statement waited for locks, if known. Updated by
+        # sqlibrist.monitor.ProgressMonitor
+        self.lock_wait = None
+
+    def add_hook(self, hook):
+        """
+        Registers hook object (see sqlibrist.hooks.BaseHook), notified about
+        executed migrations and statements
+        """
+        self.hooks.append(hook)
+
+    def call_hooks(self, event, **kwargs):
+        for hook in self.hooks:
+            getattr(hook, event)(self, **kwargs)
+
+    def execute_statement(self, cursor, statement):
+        cursor.execute(statement)
+        return cursor.rowcount
+
+    def quote_name(self, name):
+        raise NotImplementedError
+
+    def copy_data(self, cursor, table, columns, data_file):
+        """
+        Bulk loads CSV rows (without header line) from binary file object
+        into table columns, returns number of loaded rows
+        """
+        raise NotImplementedError
+
+    def get_primary_key(self, cursor, table):
+        """
+        Returns primary key columns of table, empty list if it has none
+        """
+        return []
+
+    def get_reload_statements(self, table, columns, key):
+        """
+        Returns statements, that delete rows of table, missing in
+        RELOAD_TABLE, insert new and update changed rows, and drop
+        RELOAD_TABLE
+        """
+        raise NotImplementedError
+
+    def reload_data(self, cursor, table, columns, data_file):
+        """
+        Replaces rows of table with CSV rows. Existing rows are updated by
+        primary key and only rows, missing in CSV, are deleted, so rows,
+        referenced by foreign keys, stay. Table without primary key is
+        emptied and loaded again
+        """
+        key = self.get_primary_key(cursor, table)
+        if not key or not set(key) <= set(columns):
+            cursor.execute('DELETE FROM %s;' % self.quote_name(table))
+            return self.copy_data(cursor, table, columns, data_file)
+
+        cursor.execute('CREATE TEMPORARY TABLE %s AS SELECT %s FROM %s '
+                       'LIMIT 0;' % (
+                           self.quote_name(RELOAD_TABLE),
+                           ', '.join(self.quote_name(column)
+                                     for column in columns),
+                           self.quote_name(table)))
+        rowcount = self.copy_data(cursor, RELOAD_TABLE, columns, data_file)
+        for statement in self.get_reload_statements(table, columns, key):
+            cursor.execute(statement)
+        return rowcount
+
+    def execute_data(self, cursor, table, path, reload_data=False):
+        """
+        Loads CSV file from migrations store into table. Header line of file
+        holds column names
+        """
+        import csv
+        from sqlibrist.helpers import MigrationDirectory
+
+        store = self.store or MigrationDirectory()
+        data_file = store.open(path)
+        try:
+            header = data_file.readline().decode('utf8')
+            columns = [column.strip()
+                       for column in next(csv.reader([header]))]
+            if reload_data:
+                return self.reload_data(cursor, table, columns, data_file)
+            return self.copy_data(cursor, table, columns, data_file)
+        finally:
+            data_file.close()
+
+    def execute(self, cursor, migration, statement):
+        """
+        Executes single migration block, notifying hooks
+        """
+        from sqlibrist.helpers import parse_data_instruction
+
+        self.lock_wait = None
+        self.call_hooks('before_statement',
+                        migration=migration,
+                        statement=statement)
+        started = time.time()
+        data_instruction = parse_data_instruction(statement)
+        try:
+            if data_instruction:
+                rowcount = self.execute_data(cursor, *data_instruction)
+            else:
+                rowcount = self.execute_statement(cursor, statement)
+        except Exception as e:
+            self.call_hooks('on_error',
+                            migration=migration,
+                            statement=statement,
+                            error=e)
+            raise
+        self.call_hooks('after_statement',
+                        migration=migration,
+                        statement=statement,
+                        duration=time.time() - started,
+                        rowcount=rowcount,
+                        lock_wait=self.lock_wait)
+        return rowcount
+
+    def execute_migration(self, cursor, migration, statements, direction):
+        """
+        Executes migration text block by block, notifying hooks. Blocks of
+        comments only (placeholder of empty migration) are skipped, as
+        drivers refuse empty queries
+        """
+        from sqlibrist.helpers import split_blocks, has_statements
+
+        self.call_hooks('before_migration',
+                        migration=migration,
+                        direction=direction)
+        started = time.time()
+        blocks = [block for block in split_blocks(statements)
+                  if has_statements(block)]
+        for block in blocks:
+            self.execute(cursor, migration, block)
+        self.call_hooks('after_migration',
+                        migration=migration,
+                        direction=direction,
+                        duration=time.time() - started,
+                        statements=len(blocks))
 
     def get_connection(self):
         raise NotImplementedError
@@ -16,14 +425,138 @@ class BaseEngine(object):
     def get_applied_migrations(self):
         raise NotImplementedError
 
-    def apply_migration(self, name, statements, fake=False):
+    def get_partial_migrations(self):
+        """
+        Returns names of migrations, which pre-deploy phase is applied and
+        post-deploy phase is not
+        """
+        raise NotImplementedError
+
+    def apply_migration(self, name, statements, fake=False, phase=None):
+        """
+        Applies migration statements. With phase "pre" migration is recorded
+        as partially applied, with phase "post" partially applied migration
+        is recorded as applied
+        """
         raise NotImplementedError
 
     def unapply_migration(self, name, statements, fake=False):
         raise NotImplementedError
 
+    def unapply_migrations(self, migrations, fake=False):
+        """
+        Unapplies list of (name, statements) in given order. Engines, that
+        support transactional DDL, do it in single transaction
+        """
+        from sqlibrist.helpers import ApplyMigrationFailed
+
+        reverted = []
+        try:
+            for name, statements in migrations:
+                self.unapply_migration(name, statements, fake)
+                reverted.append(name)
+        except ApplyMigrationFailed:
+            if reverted:
+                raise ApplyMigrationFailed(
+                    'reverted before the error: %s' % ', '.join(reverted))
+            raise
+
+    def apply_migration_resumable(self, name, blocks, checksum, phase=None,
+                                  autocommit=()):
+        """
+        Applies migration blocks, committing each one separately, so that
+        interrupted migration is resumed. Blocks with indexes, listed in
+        autocommit, are executed outside of transaction
+        """
+        raise NotImplementedError
+
+    def get_interrupted_migrations(self):
+        """
+        Returns names of migrations, partially applied by interrupted
+        resumable migrate
+        """
+        return []
+
+    def forget_interrupted_migrations(self):
+        """
+        Drops checkpoints of interrupted migrations, so that they are applied
+        from the first block again
+        """
+
+    def get_catalog_snapshot(self):
+        """
+        Returns list of (kind, name, definition) of all objects in DB
+        """
+        raise NotImplementedError
+
+    def get_relation_stats(self, tables):
+        """
+        Returns dict of table name: (estimated rows, table size, total size
+        of indexes) from DB statistics. Sizes are in bytes, unknown tables
+        are omitted
+        """
+        raise NotImplementedError
+
+    def get_materialized_views(self, names):
+        """
+        Returns dict of materialized view name: (is populated, has unique
+        index, required by REFRESH ... CONCURRENTLY)
+        """
+        raise NotImplementedError
+
+    def get_partitions(self, table):
+        """
+        Returns partition key definition of partitioned table (None if table
+        is not partitioned) and list of (name, bound) of its partitions
+        """
+        raise NotImplementedError
+
+    def execute_autocommit(self, name, statements):
+        """
+        Executes statements one by one outside of transaction, notifying
+        hooks. name is passed to hooks as migration name
+        """
+        raise NotImplementedError
+
+    def get_backend_id(self):
+        """
+        Returns server process/thread id of engine's connection
+        """
+        raise NotImplementedError
+
+    def get_fingerprint(self):
+        """
+        Returns fingerprint of migrations, saved after all of them were
+        applied, or None
+        """
+        raise NotImplementedError
+
+    def set_fingerprint(self, fingerprint):
+        raise NotImplementedError
+
+    def acquire_lock(self, timeout):
+        """
+        Takes database-level lock for migrations, waiting up to timeout
+        seconds. Returns True, if lock was acquired
+        """
+        raise NotImplementedError
+
+    def release_lock(self):
+        raise NotImplementedError
+
+    def get_progress(self, backend_id):
+        """
+        Returns progress of statement, executed by given backend, as dict
+        with keys: state, waiting (for lock), phase, done, total (units of
+        work in phase, None if unknown) and blocking (list of sessions,
+        holding required locks)
+        """
+        raise NotImplementedError
+
 
 class Postgresql(BaseEngine):
+    transactional_ddl = True
+
     def get_connection(self):
         if self.connection is None:
             import psycopg2
@@ -36,6 +569,25 @@ class Postgresql(BaseEngine):
             )
         return self.connection
 
+    def quote_name(self, name):
+        return '"%s"' % name.replace('"', '""')
+
+    def copy_data(self, cursor, table, columns, data_file):
+        cursor.copy_expert(
+            'COPY %s (%s) FROM STDIN WITH CSV' % (
+                self.quote_name(table),
+                ', '.join(self.quote_name(column) for column in columns)),
+            data_file)
+        return cursor.rowcount
+
+    def get_primary_key(self, cursor, table):
+        cursor.execute(POSTGRESQL_PRIMARY_KEY, [self.quote_name(table)])
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_reload_statements(self, table, columns, key):
+        return get_postgresql_reload_statements(self.quote_name, table,
+                                                columns, key)
+
     def create_migrations_table(self):
         connection = self.get_connection()
         print('Creating schema and migrations log table...\n')
@@ -50,6 +602,30 @@ class Postgresql(BaseEngine):
             );
             ''')
 
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sqlibrist.migration_progress (
+            migration TEXT PRIMARY KEY,
+            checksum TEXT,
+            block INTEGER,
+            datetime TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            );
+            ''')
+
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sqlibrist.state (
+            name TEXT PRIMARY KEY,
+            value TEXT
+            );
+            ''')
+
+            cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sqlibrist.migration_phases (
+            migration TEXT PRIMARY KEY,
+            phase TEXT,
+            datetime TIMESTAMPTZ DEFAULT CURRENT_TIMESTAMP
+            );
+            ''')
+
     def get_applied_migrations(self):
         connection = self.get_connection()
         with connection.cursor() as cursor:
@@ -68,25 +644,60 @@ class Postgresql(BaseEngine):
             result = cursor.fetchone()
             return result and result[0] or None
 
-    def apply_migration(self, name, statements, fake=False):
+    def get_partial_migrations(self):
         import psycopg2
+
         connection = self.get_connection()
         with connection.cursor() as cursor:
             try:
-                if not fake and statements.strip():
-                    cursor.execute(statements)
-            except (
-                    psycopg2.OperationalError,
-                    psycopg2.ProgrammingError) as e:
+                cursor.execute('SELECT migration '
+                               'FROM sqlibrist.migration_phases '
+                               'ORDER BY datetime;')
+            except psycopg2.ProgrammingError:
+                # created by initdb of older version
                 connection.rollback()
-                print(e.message)
+                return []
+            result = [row[0] for row in cursor.fetchall()]
+        connection.rollback()
+        return result
+
+    def record_migration(self, cursor, name, phase=None):
+        from sqlibrist.helpers import PHASE_PRE, PHASE_POST
+
+        if phase == PHASE_PRE:
+            cursor.execute('INSERT INTO sqlibrist.migration_phases '
+                           '(migration, phase) VALUES (%s, %s);',
+                           [name, phase])
+            return
+        if phase == PHASE_POST:
+            # keeps position of pre-deploy phase in ledger, which is
+            # ordered by datetime, so that revert order is not broken
+            cursor.execute('INSERT INTO sqlibrist.migrations '
+                           '(migration, datetime) '
+                           'SELECT migration, datetime '
+                           'FROM sqlibrist.migration_phases '
+                           'WHERE migration = %s;', [name])
+            cursor.execute('DELETE FROM sqlibrist.migration_phases '
+                           'WHERE migration = %s;', [name])
+            return
+        cursor.execute('INSERT INTO sqlibrist.migrations '
+                       '(migration) VALUES (%s);', [name])
+
+    def apply_migration(self, name, statements, fake=False, phase=None):
+        import psycopg2
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            try:
+                if not fake:
+                    self.execute_migration(cursor, name, statements, 'up')
+            except psycopg2.Error as e:
+                connection.rollback()
+                print(e)
                 from sqlibrist.helpers import ApplyMigrationFailed
 
                 raise ApplyMigrationFailed
             else:
-                cursor.execute('INSERT INTO sqlibrist.migrations '
-                               '(migration) VALUES (%s);',
-                               [name.split('/')[-1]])
+                self.record_migration(cursor, name.split('/')[-1], phase)
                 connection.commit()
 
     def unapply_migration(self, name, statements, fake=False):
@@ -95,12 +706,10 @@ class Postgresql(BaseEngine):
         with connection.cursor() as cursor:
             try:
                 if not fake:
-                    cursor.execute(statements)
-            except (
-                    psycopg2.OperationalError,
-                    psycopg2.ProgrammingError) as e:
+                    self.execute_migration(cursor, name, statements, 'down')
+            except psycopg2.Error as e:
                 connection.rollback()
-                print(e.message)
+                print(e)
                 from sqlibrist.helpers import ApplyMigrationFailed
 
                 raise ApplyMigrationFailed
@@ -109,8 +718,298 @@ class Postgresql(BaseEngine):
                                'WHERE migration = (%s); ', [name])
                 connection.commit()
 
+    def unapply_migrations(self, migrations, fake=False):
+        import psycopg2
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            try:
+                if not fake:
+                    for name, statements in migrations:
+                        self.execute_migration(cursor, name, statements,
+                                               'down')
+            except psycopg2.Error as e:
+                connection.rollback()
+                print(e)
+                from sqlibrist.helpers import ApplyMigrationFailed
+
+                raise ApplyMigrationFailed
+            else:
+                cursor.execute('DELETE FROM sqlibrist.migrations '
+                               'WHERE migration = ANY(%s);',
+                               [[name for name, _ in migrations]])
+                connection.commit()
+
+    def get_interrupted_migrations(self):
+        import psycopg2
+
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('SELECT migration '
+                               'FROM sqlibrist.migration_progress;')
+            except psycopg2.ProgrammingError:
+                # created by initdb of older version
+                connection.rollback()
+                return []
+            result = [row[0] for row in cursor.fetchall()]
+        connection.rollback()
+        return result
+
+    def forget_interrupted_migrations(self):
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM sqlibrist.migration_progress;')
+        connection.commit()
+
+    def apply_migration_resumable(self, name, blocks, checksum, phase=None,
+                                  autocommit=()):
+        """
+        Applies migration block by block, committing each block together
+        with checkpoint in sqlibrist.migration_progress. Interrupted
+        migration continues from the first unfinished block. Autocommit
+        block is checkpointed after it is executed, so interrupted in
+        between it runs again and must be repeatable (IF NOT EXISTS)
+        """
+        import psycopg2
+        from sqlibrist.helpers import ApplyMigrationFailed, \
+            MigrationChecksumMismatch, has_statements, split_autocommit_block
+
+        blocks = [(block, i in autocommit)
+                  for i, block in enumerate(blocks)
+                  if has_statements(block)]
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT checksum, block '
+                           'FROM sqlibrist.migration_progress '
+                           'WHERE migration = %s;', [name])
+            progress = cursor.fetchone()
+            if progress is None:
+                cursor.execute('INSERT INTO sqlibrist.migration_progress '
+                               '(migration, checksum, block) '
+                               'VALUES (%s, %s, 0);', [name, checksum])
+                connection.commit()
+                done = 0
+            elif progress[0] != checksum and progress[1] == 0:
+                # no block was committed, run failed at the first one, so
+                # fixed migration starts over
+                cursor.execute('UPDATE sqlibrist.migration_progress '
+                               'SET checksum = %s, '
+                               'datetime = CURRENT_TIMESTAMP '
+                               'WHERE migration = %s;', [checksum, name])
+                connection.commit()
+                done = 0
+            elif progress[0] != checksum:
+                connection.rollback()
+                raise MigrationChecksumMismatch(
+                    'Migration %s was partially applied, but its up.sql '
+                    'has changed since - refusing to resume, apply it '
+                    'again with "migrate --restart-interrupted"' % name)
+            else:
+                # autocommit mode can not be set inside transaction
+                connection.rollback()
+                done = progress[1]
+                print('resuming from block %s of %s... '
+                      % (done + 1, len(blocks)), end='')
+
+            self.call_hooks('before_migration',
+                            migration=name,
+                            direction='up')
+            started = time.time()
+            for i, (block, block_autocommit) in enumerate(blocks[done:],
+                                                         done + 1):
+                try:
+                    connection.autocommit = block_autocommit
+                    if block_autocommit:
+                        for statement in split_autocommit_block(block):
+                            self.execute(cursor, name, statement)
+                    else:
+                        self.execute(cursor, name, block)
+                except psycopg2.Error as e:
+                    connection.rollback()
+                    print(e)
+                    raise ApplyMigrationFailed
+                else:
+                    cursor.execute('UPDATE sqlibrist.migration_progress '
+                                   'SET block = %s, '
+                                   'datetime = CURRENT_TIMESTAMP '
+                                   'WHERE migration = %s;', [i, name])
+                    connection.commit()
+                finally:
+                    connection.autocommit = False
+
+            self.record_migration(cursor, name, phase)
+            cursor.execute('DELETE FROM sqlibrist.migration_progress '
+                           'WHERE migration = %s;', [name])
+            connection.commit()
+            self.call_hooks('after_migration',
+                            migration=name,
+                            direction='up',
+                            duration=time.time() - started,
+                            statements=len(blocks) - done)
+
+    def get_catalog_snapshot(self):
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_CATALOG_SNAPSHOT)
+            snapshot = cursor.fetchall()
+        connection.rollback()
+        return snapshot
+
+    def get_relation_stats(self, tables):
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_RELATION_STATS, [list(tables)])
+            rows = cursor.fetchall()
+        connection.rollback()
+        return dict((name, (max(0, reltuples), table_size, index_size))
+                    for name, reltuples, table_size, index_size in rows)
+
+    def get_materialized_views(self, names):
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_MATERIALIZED_VIEWS, [list(names)])
+            rows = cursor.fetchall()
+        connection.rollback()
+        return dict((name, (populated, unique_index))
+                    for name, populated, unique_index in rows)
+
+    def get_partitions(self, table):
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute(POSTGRESQL_PARTITION_KEY, [table])
+            row = cursor.fetchone()
+            cursor.execute(POSTGRESQL_PARTITIONS, [table])
+            partitions = cursor.fetchall()
+        connection.rollback()
+        return row and row[0], partitions
+
+    def execute_autocommit(self, name, statements):
+        import psycopg2
+
+        connection = self.get_connection()
+        autocommit = connection.autocommit
+        connection.autocommit = True
+        try:
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    self.execute(cursor, name, statement)
+        except psycopg2.Error as e:
+            print(e)
+            from sqlibrist.helpers import ApplyMigrationFailed
+
+            raise ApplyMigrationFailed
+        finally:
+            connection.autocommit = autocommit
+
+    def get_backend_id(self):
+        return self.get_connection().get_backend_pid()
+
+    def get_fingerprint(self):
+        import psycopg2
+
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('SELECT value FROM sqlibrist.state '
+                               'WHERE name = \'fingerprint\';')
+            except psycopg2.ProgrammingError:
+                # created by initdb of older version
+                connection.rollback()
+                return None
+            result = cursor.fetchone()
+        connection.rollback()
+        return result and result[0] or None
+
+    def set_fingerprint(self, fingerprint):
+        import psycopg2
+
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute('DELETE FROM sqlibrist.state '
+                               'WHERE name = \'fingerprint\';')
+                if fingerprint:
+                    cursor.execute('INSERT INTO sqlibrist.state (name, value) '
+                                   'VALUES (\'fingerprint\', %s);',
+                                   [fingerprint])
+            except psycopg2.ProgrammingError:
+                connection.rollback()
+            else:
+                connection.commit()
+
+    def acquire_lock(self, timeout):
+        connection = self.get_connection()
+        deadline = time.time() + timeout
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute('SELECT pg_try_advisory_lock(%s);',
+                               [MIGRATE_LOCK_ID])
+                acquired = cursor.fetchone()[0]
+                # session-level lock stays after commit, transaction is
+                # not kept open while waiting
+                connection.commit()
+                if acquired or time.time() >= deadline:
+                    return acquired
+                time.sleep(max(0, min(LOCK_POLL_INTERVAL,
+                                      deadline - time.time())))
+
+    def release_lock(self):
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s);',
+                           [MIGRATE_LOCK_ID])
+        connection.commit()
+
+    def get_progress(self, backend_id):
+        import psycopg2
+
+        connection = self.get_connection()
+        with connection.cursor() as cursor:
+            try:
+                cursor.execute(POSTGRESQL_PROGRESS, [backend_id])
+            except psycopg2.ProgrammingError:
+                # progress views appeared in PostgreSQL 12
+                connection.rollback()
+                cursor.execute(POSTGRESQL_ACTIVITY, [backend_id])
+            row = cursor.fetchone()
+        connection.rollback()
+        if row is None:
+            return None
+
+        state, wait_event_type, wait_event, blocking = row[:4]
+        progress = {'state': state,
+                    'waiting': wait_event_type == 'Lock',
+                    'phase': wait_event and '%s: %s' % (wait_event_type,
+                                                        wait_event),
+                    'done': None,
+                    'total': None,
+                    'blocking': blocking or []}
+        if len(row) > 4:
+            (index_phase, blocks_done, blocks_total, tuples_done,
+             tuples_total, cluster_phase, heap_done, heap_total) = row[4:]
+            if index_phase:
+                progress['phase'] = index_phase
+                if blocks_total:
+                    progress.update(done=blocks_done, total=blocks_total)
+                elif tuples_total:
+                    progress.update(done=tuples_done, total=tuples_total)
+            elif cluster_phase:
+                progress['phase'] = cluster_phase
+                if heap_total:
+                    progress.update(done=heap_done, total=heap_total)
+        return progress
+
 
 class MySQL(BaseEngine):
+    def execute_statement(self, cursor, statement):
+        cursor.execute(statement)
+        rowcount = cursor.rowcount
+        # block may contain several statements, their results must be read
+        # before the next execute
+        while cursor.nextset():
+            pass
+        return rowcount
+
     def get_connection(self):
         if self.connection is None:
             import MySQLdb
@@ -120,9 +1019,63 @@ class MySQL(BaseEngine):
                 host=self.config.get('host', '127.0.0.1'),
                 passwd=self.config.get('password'),
                 port=self.config.get('port'),
+                local_infile=1,
             )
         return self.connection
 
+    def quote_name(self, name):
+        return '`%s`' % name.replace('`', '``')
+
+    def copy_data(self, cursor, table, columns, data_file):
+        import shutil
+        import tempfile
+
+        statement = ('LOAD DATA LOCAL INFILE %%s INTO TABLE %s '
+                     'CHARACTER SET utf8mb4 '
+                     'FIELDS TERMINATED BY \',\' '
+                     'OPTIONALLY ENCLOSED BY \'"\' '
+                     'LINES TERMINATED BY \'\\n\' '
+                     'IGNORE 1 LINES (%s);' % (
+                         self.quote_name(table),
+                         ', '.join(self.quote_name(column)
+                                   for column in columns)))
+        filename = getattr(data_file, 'name', None)
+        if isinstance(filename, str) and os.path.isfile(filename):
+            cursor.execute(statement, [filename])
+            return cursor.rowcount
+
+        # file is packed, LOAD DATA needs it on disk
+        with tempfile.NamedTemporaryFile(suffix='.csv') as f:
+            f.write(b'\n')
+            shutil.copyfileobj(data_file, f)
+            f.flush()
+            cursor.execute(statement, [f.name])
+        return cursor.rowcount
+
+    def get_primary_key(self, cursor, table):
+        cursor.execute(MYSQL_PRIMARY_KEY, [table])
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_reload_statements(self, table, columns, key):
+        quoted_table = self.quote_name(table)
+        reload_table = self.quote_name(RELOAD_TABLE)
+        names = ', '.join(self.quote_name(column) for column in columns)
+        return [
+            'DELETE t FROM %s t LEFT JOIN %s r ON %s WHERE r.%s IS NULL;' % (
+                quoted_table, reload_table, ' AND '.join(
+                    'r.%s = t.%s' % (self.quote_name(column),
+                                     self.quote_name(column))
+                    for column in key),
+                self.quote_name(key[0])),
+            'INSERT INTO %s (%s) SELECT %s FROM %s '
+            'ON DUPLICATE KEY UPDATE %s;' % (
+                quoted_table, names, names, reload_table,
+                ', '.join('%s = VALUES(%s)' % (self.quote_name(column),
+                                               self.quote_name(column))
+                          for column in columns)),
+            'DROP TEMPORARY TABLE %s;' % reload_table,
+        ]
+
     def create_migrations_table(self):
         connection = self.get_connection()
         cursor = connection.cursor()
@@ -134,6 +1087,19 @@ class MySQL(BaseEngine):
             `datetime` TIMESTAMP
            );
         ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sqlibrist_state (
+            name VARCHAR(64) PRIMARY KEY,
+            value TEXT
+           );
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS sqlibrist_migration_phases (
+            migration VARCHAR(255) PRIMARY KEY,
+            phase VARCHAR(16),
+            `datetime` TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+           );
+        ''')
 
     def get_applied_migrations(self):
         connection = self.get_connection()
@@ -154,23 +1120,53 @@ class MySQL(BaseEngine):
         result = cursor.fetchone()
         return result and result[0] or None
 
-    def apply_migration(self, name, statements, fake=False):
+    def get_partial_migrations(self):
         import MySQLdb
+
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT migration '
+                           'FROM sqlibrist_migration_phases '
+                           'ORDER BY `datetime`;')
+        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError):
+            return []
+        return [row[0] for row in cursor.fetchall()]
+
+    def apply_migration(self, name, statements, fake=False, phase=None):
+        import MySQLdb
+        from sqlibrist.helpers import PHASE_PRE, PHASE_POST
+
         connection = self.get_connection()
         cursor = connection.cursor()
 
         try:
-            if not fake and statements.strip():
-                cursor.execute(statements)
-        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError) as e:
+            if not fake:
+                self.execute_migration(cursor, name, statements, 'up')
+        except MySQLdb.Error as e:
             print('\n'.join(map(str, e.args)))
             from sqlibrist.helpers import ApplyMigrationFailed
 
             raise ApplyMigrationFailed
         else:
+            name = name.split('/')[-1]
+            if phase == PHASE_PRE:
+                cursor.execute('INSERT INTO sqlibrist_migration_phases '
+                               '(migration, phase) VALUES (%s, %s);',
+                               [name, phase])
+                return
+            if phase == PHASE_POST:
+                # keeps position of pre-deploy phase in ledger
+                cursor.execute('INSERT INTO sqlibrist_migrations '
+                               '(migration, `datetime`) '
+                               'SELECT migration, `datetime` '
+                               'FROM sqlibrist_migration_phases '
+                               'WHERE migration = %s;', [name])
+                cursor.execute('DELETE FROM sqlibrist_migration_phases '
+                               'WHERE migration = %s;', [name])
+                return
             cursor.execute('INSERT INTO sqlibrist_migrations '
-                           '(migration) VALUES (%s);',
-                           [name.split('/')[-1]])
+                           '(migration) VALUES (%s);', [name])
 
     def unapply_migration(self, name, statements, fake=False):
         import MySQLdb
@@ -179,8 +1175,8 @@ class MySQL(BaseEngine):
 
         try:
             if not fake:
-                cursor.execute(statements)
-        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError) as e:
+                self.execute_migration(cursor, name, statements, 'down')
+        except MySQLdb.Error as e:
             print('\n'.join(map(str, e.args)))
             from sqlibrist.helpers import ApplyMigrationFailed
 
@@ -188,3 +1184,159 @@ class MySQL(BaseEngine):
         else:
             cursor.execute('DELETE FROM sqlibrist_migrations '
                            'WHERE migration = (%s); ', [name])
+
+    def unapply_migrations(self, migrations, fake=False):
+        import MySQLdb
+        connection = self.get_connection()
+        cursor = connection.cursor()
+
+        # DDL statements are committed implicitly by MySQL, so migrations
+        # can not be reverted atomically. On error, ledger rows are deleted
+        # for already reverted migrations only
+        reverted = []
+        failed = False
+        try:
+            for name, statements in migrations:
+                if not fake:
+                    self.execute_migration(cursor, name, statements, 'down')
+                reverted.append(name)
+        except MySQLdb.Error as e:
+            print('\n'.join(map(str, e.args)))
+            failed = True
+
+        recorded = True
+        if reverted:
+            try:
+                cursor.execute('DELETE FROM sqlibrist_migrations '
+                               'WHERE migration IN (%s);'
+                               % ', '.join(['%s'] * len(reverted)),
+                               reverted)
+            except MySQLdb.Error as e:
+                # original error is already printed
+                print('\n'.join(map(str, e.args)))
+                recorded = False
+
+        if failed or not recorded:
+            from sqlibrist.helpers import ApplyMigrationFailed
+
+            if not recorded:
+                raise ApplyMigrationFailed(
+                    'reverted, but still logged as applied: %s'
+                    % ', '.join(reverted))
+            elif reverted:
+                raise ApplyMigrationFailed(
+                    'reverted before the error: %s' % ', '.join(reverted))
+            raise ApplyMigrationFailed
+
+    def apply_migration_resumable(self, name, blocks, checksum, phase=None,
+                                  autocommit=()):
+        from sqlibrist.helpers import BadConfig
+
+        raise BadConfig('Resumable migrations are supported only by '
+                        'PostgreSQL engine')
+
+    def get_catalog_snapshot(self):
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        cursor.execute('SET SESSION group_concat_max_len = 1048576;')
+        cursor.execute(MYSQL_CATALOG_SNAPSHOT)
+        return [row for row in cursor.fetchall()
+                if not row[1].startswith('sqlibrist_')]
+
+    def get_relation_stats(self, tables):
+        tables = list(tables)
+        if not tables:
+            return {}
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        cursor.execute('SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH, '
+                       'INDEX_LENGTH '
+                       'FROM information_schema.TABLES '
+                       'WHERE TABLE_SCHEMA = DATABASE() '
+                       'AND TABLE_NAME IN (%s);'
+                       % ', '.join(['%s'] * len(tables)), tables)
+        return dict((name, (rows or 0, data_length or 0, index_length or 0))
+                    for name, rows, data_length, index_length
+                    in cursor.fetchall())
+
+    def get_partitions(self, table):
+        from sqlibrist.helpers import BadConfig
+
+        raise BadConfig('Partition management is supported only by '
+                        'PostgreSQL engine')
+
+    def get_materialized_views(self, names):
+        from sqlibrist.helpers import BadConfig
+
+        raise BadConfig('Materialized views are supported only by '
+                        'PostgreSQL engine')
+
+    def get_backend_id(self):
+        return self.get_connection().thread_id()
+
+    def get_fingerprint(self):
+        import MySQLdb
+
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT value FROM sqlibrist_state '
+                           'WHERE name = \'fingerprint\';')
+        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError):
+            return None
+        result = cursor.fetchone()
+        return result and result[0] or None
+
+    def set_fingerprint(self, fingerprint):
+        import MySQLdb
+
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute('DELETE FROM sqlibrist_state '
+                           'WHERE name = \'fingerprint\';')
+            if fingerprint:
+                cursor.execute('INSERT INTO sqlibrist_state (name, value) '
+                               'VALUES (\'fingerprint\', %s);',
+                               [fingerprint])
+        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError):
+            pass
+        else:
+            connection.commit()
+
+    def acquire_lock(self, timeout):
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        cursor.execute('SELECT GET_LOCK(CONCAT(\'sqlibrist:\', DATABASE()), '
+                       '%s);', [int(timeout)])
+        return cursor.fetchone()[0] == 1
+
+    def release_lock(self):
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        cursor.execute('SELECT RELEASE_LOCK('
+                       'CONCAT(\'sqlibrist:\', DATABASE()));')
+
+    def get_progress(self, backend_id):
+        import MySQLdb
+
+        connection = self.get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(MYSQL_PROGRESS, [backend_id])
+        except (MySQLdb.OperationalError, MySQLdb.ProgrammingError):
+            # performance_schema or sys schema is not available
+            cursor.execute('SELECT STATE, NULL, NULL, NULL, NULL '
+                           'FROM information_schema.PROCESSLIST '
+                           'WHERE ID = %s;', [backend_id])
+        row = cursor.fetchone()
+        if row is None:
+            return None
+
+        state, stage, done, total, blocking = row
+        return {'state': state,
+                'waiting': bool(state) and 'lock' in state.lower(),
+                'phase': stage or state,
+                'done': done,
+                'total': total,
+                'blocking': blocking and blocking.split(',') or []}
@@ -4,23 +4,39 @@ from __future__ import print_function
 import argparse
 import glob
 import hashlib
+import importlib
 import os
 import re
-from json import loads, dumps
-
-from sqlibrist.engines import Postgresql, MySQL
+from collections import namedtuple
 
 ENGINE_POSTGRESQL = 'pg'
 ENGINE_MYSQL = 'mysql'
 
+# engines and commands are referenced by import path and imported only when
+# used, so that CLI startup does not pay for unused modules
 ENGINES = {
-    ENGINE_POSTGRESQL: Postgresql,
-    ENGINE_MYSQL: MySQL
+    ENGINE_POSTGRESQL: 'sqlibrist.engines:Postgresql',
+    ENGINE_MYSQL: 'sqlibrist.engines:MySQL'
 }
 
+ENGINES_ENTRY_POINT = 'sqlibrist.engines'
+COMMANDS_ENTRY_POINT = 'sqlibrist.commands'
+
+DEFAULT_PACK_FILE = 'migrations.pack'
+
+PHASE_PRE = 'pre'
+PHASE_POST = 'post'
+PHASE_DIRECTIVE = re.compile(r'^--PHASE\s+(%s|%s)(\s+autocommit)?\s*$'
+                             % (PHASE_PRE, PHASE_POST),
+                             re.I)
+
+PhaseBlock = namedtuple('PhaseBlock', 'phase autocommit block line')
+
 
 class SqlibristException(Exception):
-    pass
+    @property
+    def message(self):
+        return self.args[0] if self.args else ''
 
 
 class CircularDependencyException(SqlibristException):
@@ -43,6 +59,22 @@ class MigrationIrreversible(SqlibristException):
     pass
 
 
+class MigrationChecksumMismatch(SqlibristException):
+    pass
+
+
+class SchemaDrift(SqlibristException):
+    pass
+
+
+class LockTimeout(SqlibristException):
+    pass
+
+
+class LintFailed(SqlibristException):
+    pass
+
+
 class LazyConfig(object):
     def __init__(self, args):
         self.args = args
@@ -88,19 +120,284 @@ class LazyConfig(object):
             return repr(self)
 
 
+def import_object(path):
+    """
+    Imports object by "package.module:attribute" path
+    """
+    module_name, _, attribute = path.partition(':')
+    module = importlib.import_module(module_name)
+    return getattr(module, attribute)
+
+
+def iter_entry_points(group):
+    """
+    Yields (name, import path) of installed entry points in group without
+    importing them
+    """
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return
+        for entry_point in pkg_resources.iter_entry_points(group):
+            yield entry_point.name, '%s:%s' % (entry_point.module_name,
+                                               '.'.join(entry_point.attrs))
+    else:
+        installed = entry_points()
+        if hasattr(installed, 'select'):
+            installed = installed.select(group=group)
+        else:
+            installed = installed.get(group, [])
+        for entry_point in installed:
+            yield entry_point.name, entry_point.value
+
+
 def get_engine(config, connection=None):
     try:
-        return ENGINES[config['engine']](config, connection)
+        engine_name = config['engine']
+    except KeyError:
+        engine_name = None
+
+    engines = ENGINES
+    if engine_name not in engines:
+        engines = dict(iter_entry_points(ENGINES_ENTRY_POINT), **ENGINES)
+    try:
+        engine_path = engines[engine_name]
     except KeyError:
         raise BadConfig('DB engine not selected in config or wrong engine '
-                        'name (must be one of %s)' % ','.join(ENGINES.keys()))
+                        'name (must be one of %s)' % ','.join(engines.keys()))
+    return import_object(engine_path)(config, connection)
+
+
+def get_checksum(text):
+    return hashlib.md5(text.encode()).hexdigest()
+
+
+def split_numbered_blocks(statements):
+    """
+    Splits migration text into blocks, delimited with "-- begin --" and
+    "-- end --" lines by save_migration. Text outside of markers (manually
+    written migrations) becomes separate block. Returns list of (number of
+    first line of block, block)
+    """
+    blocks = []
+    block = []
+    start = 1
+    for number, line in enumerate(statements.splitlines(), 1):
+        marker = line.strip()
+        if marker in ('-- begin --', '-- end --'):
+            if '\n'.join(block).strip():
+                blocks.append((start, '\n'.join(block)))
+            block = []
+            start = number + 1
+        else:
+            block.append(line)
+    if '\n'.join(block).strip():
+        blocks.append((start, '\n'.join(block)))
+    return blocks
+
+
+def split_blocks(statements):
+    return [block for _, block in split_numbered_blocks(statements)]
+
+
+def join_blocks(blocks):
+    return ''.join('-- begin --\n%s\n-- end --\n' % block for block in blocks)
+
+
+def split_phases(statements):
+    """
+    Returns list of PhaseBlock of migration text. Block, starting with
+    "--PHASE post" line, is applied in post-deploy phase, with
+    "--PHASE post autocommit" - also outside of transaction (for statements
+    like CREATE INDEX CONCURRENTLY). Block, consisting of the directive
+    only, sets phase of the following blocks. Directive lines are removed
+    from blocks
+    """
+    phase = PHASE_PRE
+    autocommit = False
+    phases = []
+    for line, block in split_numbered_blocks(statements):
+        lines = block.splitlines()
+        first = next(i for i, text in enumerate(lines) if text.strip())
+        match = PHASE_DIRECTIVE.match(lines[first].strip())
+        if match is None:
+            phases.append(PhaseBlock(phase, autocommit, block, line))
+            continue
+        rest = '\n'.join(lines[first + 1:])
+        if rest.strip():
+            phases.append(PhaseBlock(match.group(1).lower(),
+                                     bool(match.group(2)),
+                                     rest,
+                                     line + first + 1))
+        else:
+            phase = match.group(1).lower()
+            autocommit = bool(match.group(2))
+    return phases
+
+
+def get_phase_blocks(statements, phase=None):
+    """
+    Returns blocks of migration text, applied in given phase (all blocks if
+    phase is None)
+    """
+    return [phase_block.block
+            for phase_block in split_phases(statements)
+            if phase in (None, phase_block.phase)]
+
+
+class MigrationDirectory(object):
+    """
+    Migrations, stored as directories in "migrations/"
+    """
+    def __init__(self, path='migrations'):
+        self.path = path
 
+    def list(self):
+        return sorted(os.path.basename(migration)
+                      for migration in glob.glob(os.path.join(self.path,
+                                                              '*')))
 
-def get_last_schema():
-    schemas = sorted(glob.glob('migrations/*'))
-    if schemas:
-        with open(os.path.join(schemas[-1], 'schema.json'), 'r') as f:
-            schema = loads(f.read())
+    def read(self, migration, filename):
+        with open(os.path.join(self.path, migration, filename), 'r') as f:
+            return f.read()
+
+    def get_fingerprint(self):
+        return get_migrations_fingerprint(self)
+
+    def open(self, path):
+        return open(os.path.join(self.path, path), 'rb')
+
+
+class MigrationPack(object):
+    """
+    Migrations, packed by "sqlibrist pack" into single zip file. Zip central
+    directory serves as index, files are read with random access without
+    extraction
+    """
+    def __init__(self, path):
+        import zipfile
+
+        try:
+            self.zip = zipfile.ZipFile(path)
+        except (IOError, zipfile.BadZipfile):
+            raise BadConfig('Can not read migrations pack %s' % path)
+        self.path = path
+
+    def list(self):
+        return sorted(set(name.split('/')[0]
+                          for name in self.zip.namelist()))
+
+    def get_fingerprint(self):
+        # precomputed by "pack" command
+        return self.zip.comment.decode() or get_migrations_fingerprint(self)
+
+    def read(self, migration, filename):
+        try:
+            return self.zip.read('%s/%s' % (migration, filename)).decode('utf8')
+        except KeyError:
+            raise IOError('No %s in migration %s' % (filename, migration))
+
+    def open(self, path):
+        try:
+            return self.zip.open(path)
+        except KeyError:
+            raise IOError('No %s in migrations pack' % path)
+
+
+def get_migrations_fingerprint(store):
+    """
+    Checksum of migration names and their up.sql
+    """
+    return get_checksum('\n'.join(
+        '%s %s' % (migration, get_checksum(store.read(migration, 'up.sql')))
+        for migration in store.list()))
+
+
+def get_migrations_store(args=None):
+    """
+    Returns migrations pack, if given with --pack-file or if there is
+    only pack and no "migrations/" directory, otherwise migrations directory
+    """
+    pack_file = getattr(args, 'pack_file', None)
+    if pack_file:
+        return MigrationPack(pack_file)
+    elif not os.path.isdir('migrations') \
+            and os.path.isfile(DEFAULT_PACK_FILE):
+        return MigrationPack(DEFAULT_PACK_FILE)
+    return MigrationDirectory()
+
+
+SQL_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+    | '(?:[^']|'')*'
+    | "(?:[^"]|"")*"
+    | `[^`]*`
+    | \$(?P<tag>[A-Za-z_]\w*|)\$.*?\$(?P=tag)\$
+    | (?P<semicolon>;)
+    | [^-/'"`$;]+
+    | .
+    """, re.S | re.X)
+
+
+def split_statements(sql):
+    """
+    Splits SQL text into statements by semicolons outside of quotes, dollar
+    quotes and comments. Returns list of (line number, statement) with
+    comments removed
+    """
+    statements = []
+    statement = []
+    line = 1
+    start_line = None
+    for match in SQL_TOKEN.finditer(sql):
+        token = match.group(0)
+        if match.group('semicolon'):
+            if start_line is not None:
+                statements.append((start_line, ''.join(statement).strip()))
+            statement = []
+            start_line = None
+        elif match.group('comment'):
+            statement.append(' ')
+        else:
+            if start_line is None and not token.isspace():
+                leading = token[:len(token) - len(token.lstrip())]
+                start_line = line + leading.count('\n')
+            statement.append(token)
+        line += token.count('\n')
+    if start_line is not None:
+        statements.append((start_line, ''.join(statement).strip()))
+    return statements
+
+
+def has_statements(block):
+    """
+    Returns False for migration block, consisting of comments only (i.e.
+    placeholder, added by makemigration), which must not be sent to DB
+    """
+    return bool(parse_data_instruction(block) or split_statements(block))
+
+
+def split_autocommit_block(block):
+    """
+    Returns statements of autocommit block, to be executed one by one:
+    multi-statement query runs in implicit transaction, where statements
+    like CREATE INDEX CONCURRENTLY fail
+    """
+    if parse_data_instruction(block):
+        return [block]
+    return [statement for _, statement in split_statements(block)]
+
+
+def get_last_schema(store=None):
+    from json import loads
+
+    store = store or get_migrations_store()
+    migrations = store.list()
+    if migrations:
+        schema = loads(store.read(migrations[-1], 'schema.json'))
     else:
         schema = {}
     return schema
@@ -113,13 +410,36 @@ def extract_reqs(lines):
             yield requirement
 
 
+PARTITION_OPTIONS = ('key', 'interval', 'premake', 'retention')
+
+
+def extract_partition(lines, path):
+    """
+    Returns options of "--PARTITION key=... interval=..." directive as dict,
+    or None
+    """
+    for line in lines:
+        if line.strip().startswith('--PARTITION'):
+            options = {}
+            for option in line.split()[1:]:
+                name, _, value = option.partition('=')
+                if name not in PARTITION_OPTIONS or not value:
+                    raise BadConfig('Bad --PARTITION option "%s" in %s, '
+                                    'expected name=value, names are %s'
+                                    % (option, path,
+                                       ', '.join(PARTITION_OPTIONS)))
+                options[name] = value
+            return options
+    return None
+
+
 def extract_up(lines):
     on = False
     for line in lines:
         if line.strip().startswith('--UP'):
             on = True
         elif line.strip().startswith('--DOWN'):
-            raise StopIteration
+            return
         elif on:
             yield line.rstrip()
 
@@ -134,7 +454,8 @@ def extract_down(lines):
 
 
 def init_item(directory, filename):
-    with open(os.path.join(directory, filename), 'r') as f:
+    path = os.path.join(directory, filename)
+    with open(path, 'r') as f:
         lines = f.readlines()
 
     filename = '/'.join(directory.split('/')[1:] + [filename[:-4]])
@@ -142,14 +463,27 @@ def init_item(directory, filename):
     up = list(extract_up(lines))
     down = list(extract_down(lines))
     _hash = hashlib.md5(re.sub(r'\s{2,}', '', ''.join(up)).encode()).hexdigest()
+    item = {'hash': _hash,
+            'name': filename,
+            'requires': requires,
+            'required': [],
+            'up': up,
+            'down': down}
+
+    partition = extract_partition(lines, path)
+    if partition is not None:
+        item['partition'] = partition
 
-    return (filename,
-            {'hash': _hash,
-             'name': filename,
-             'requires': requires,
-             'required': [],
-             'up': up,
-             'down': down})
+    data_filename = os.path.join(directory, '%s.csv' % filename.split('/')[-1])
+    if os.path.isfile(data_filename):
+        data_hash = hashlib.md5()
+        with open(data_filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                data_hash.update(chunk)
+        item['data'] = data_filename
+        item['data_hash'] = data_hash.hexdigest()
+
+    return filename, item
 
 
 def schema_collector():
@@ -208,11 +542,52 @@ def compare_schemas(last_schema, current_schema):
     return added, removed, changed
 
 
-def save_migration(schema, plan_up, plan_down, suffix=''):
-    migration_name = '%04.f%s' % (len(glob.glob('migrations/*')) + 1, suffix)
+def get_data_table(item):
+    return item['name'].split('/')[-1]
+
+
+def get_data_instruction(item, reload_data=False):
+    """
+    Migration block, that loads item's CSV data into table, named after item.
+    With reload_data existing rows are deleted first
+    """
+    return ['--%s %s FROM %s' % ('RELOAD' if reload_data else 'COPY',
+                                 get_data_table(item),
+                                 item['data'])]
+
+
+def parse_data_instruction(block):
+    """
+    Returns (table, data path, reload_data) for data loading block, or None
+    """
+    line = block.strip()
+    if not line.startswith(('--COPY ', '--RELOAD ')):
+        return None
+    directive, table, _, path = line.split(None, 3)
+    return table, path, directive == '--RELOAD'
+
+
+def get_next_migration_name(suffix=''):
+    return '%04.f%s' % (len(glob.glob('migrations/*')) + 1, suffix)
+
+
+def save_migration(schema, plan_up, plan_down, suffix='', data=()):
+    """
+    Saves migration directory. data is list of (source filename, filename
+    in migration directory) of CSV files to copy
+    """
+    import shutil
+    from json import dumps
+
+    migration_name = get_next_migration_name(suffix)
     dirname = os.path.join('migrations', migration_name)
     print('Creating new migration %s' % migration_name)
     os.mkdir(dirname)
+    for source, target in data:
+        target = os.path.join(dirname, target)
+        if not os.path.isdir(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copyfile(source, target)
     schema_filename = os.path.join(dirname, 'schema.json')
     with open(schema_filename, 'w') as f:
         f.write(dumps(schema, indent=2))
@@ -243,20 +618,299 @@ def handle_exception(e):
         print('  %s' % ' >\n  '.join(e.message))
     elif isinstance(e, UnknownDependencyException):
         print('Unknown dependency %s at %s' % e.message)
-    elif isinstance(e, (BadConfig, MigrationIrreversible)):
+    elif isinstance(e, (BadConfig,
+                        MigrationIrreversible,
+                        MigrationChecksumMismatch,
+                        LockTimeout,
+                        LintFailed)):
         print(e.message)
 
 
-def get_command_parser(parser=None):
-    from sqlibrist.commands.diff import diff
-    from sqlibrist.commands.init import init
-    from sqlibrist.commands.initdb import initdb
-    from sqlibrist.commands.makemigration import makemigration
-    from sqlibrist.commands.status import status
-    from sqlibrist.commands.test_connection import test_connection
-    from sqlibrist.commands.migrate import migrate
-    from sqlibrist.commands.info import info
-
+class LazyCommand(object):
+    """
+    Command function, referenced by import path. Command module is imported
+    on call
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def __call__(self, args, config, connection=None):
+        return import_object(self.path)(args, config, connection)
+
+
+def add_verbose_argument(parser):
+    parser.add_argument('--verbose', '-v',
+                        action='store_true', default=False)
+
+
+def add_makemigration_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('--empty',
+                        help='Create migration with empty up.sql '
+                             'for manual instructions',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--name', '-n',
+                        help='Optional migration name',
+                        type=str,
+                        default='')
+    parser.add_argument('--dry-run',
+                        help='Do not save migration',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--lint',
+                        help='Check new migration for lock and rewrite '
+                             'hazards',
+                        action='store_true',
+                        default=False)
+    add_lint_options(parser)
+
+
+def add_lint_options(parser):
+    parser.add_argument('--engine',
+                        help='DB engine to lint for, default is engine '
+                             'from config',
+                        choices=(ENGINE_POSTGRESQL, ENGINE_MYSQL))
+    parser.add_argument('--fail-on',
+                        help='Fail on hazards of given or higher severity, '
+                             'default is error',
+                        choices=('info', 'warning', 'error'),
+                        default='error')
+
+
+def add_lint_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('migrations',
+                        help='Migrations to check, default is the last one',
+                        nargs='*')
+    parser.add_argument('--all',
+                        help='Check all migrations',
+                        action='store_true',
+                        default=False)
+    add_lint_options(parser)
+
+
+def add_migrate_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('--fake',
+                        help='Mark pending migrations as applied',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--dry-run',
+                        help='Do not make actual changes to the DB',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--migration', '-m',
+                        help='Apply up to given migration number, with '
+                             '--revert unapply all migrations after it',
+                        type=str)
+    parser.add_argument('--revert', '-r',
+                        help='Unapply last migration, or migrations after '
+                             'given with --migration',
+                        action='store_true')
+    parser.add_argument('--phase',
+                        help='Apply only pre-deploy blocks of migrations or '
+                             'finish partially applied migrations with '
+                             'post-deploy blocks, default is both',
+                        choices=(PHASE_PRE, PHASE_POST))
+    parser.add_argument('--resumable',
+                        help='Commit each migration block separately '
+                             'and continue interrupted migration '
+                             'from the first unfinished block '
+                             '(PostgreSQL only)',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--restart-interrupted',
+                        help='Apply interrupted migrations from the first '
+                             'block instead of resuming them, e.g. after '
+                             'their up.sql was fixed',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--metrics-json',
+                        help='Append execution events to file in JSON lines '
+                             'format',
+                        type=str)
+    parser.add_argument('--metrics-prometheus',
+                        help='Write execution metrics to file in Prometheus '
+                             'text format',
+                        type=str)
+    parser.add_argument('--lock-timeout',
+                        help='Seconds to wait for other running migrate to '
+                             'finish, default is 300',
+                        type=float,
+                        default=300.0)
+    parser.add_argument('--no-lock',
+                        help='Do not take database lock for migrate',
+                        dest='lock',
+                        action='store_false',
+                        default=True)
+    parser.add_argument('--progress',
+                        help='Show progress of long-running statements, '
+                             'polled from the second connection',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--progress-interval',
+                        help='Progress polling interval in seconds, '
+                             'default is 2',
+                        type=float,
+                        default=2.0)
+
+
+def add_drift_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('configs',
+                        help='Config names to check, default is config '
+                             'given with --config',
+                        nargs='*')
+    parser.add_argument('--record',
+                        help='Save catalog snapshot of the DB as baseline '
+                             'for the last migration',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--json',
+                        help='Print report in JSON format',
+                        action='store_true',
+                        default=False)
+    parser.add_argument('--jobs', '-j',
+                        help='Number of DBs checked concurrently',
+                        type=int,
+                        default=8)
+
+
+def add_pack_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('--output', '-o',
+                        help='Pack file name, default is %s'
+                             % DEFAULT_PACK_FILE,
+                        type=str,
+                        default=DEFAULT_PACK_FILE)
+
+
+def add_partitions_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('tables',
+                        help='Partitioned tables to maintain, default is '
+                             'all tables with --PARTITION directive',
+                        nargs='*')
+    parser.add_argument('--dry-run',
+                        help='Print statements without executing them',
+                        action='store_true',
+                        default=False)
+
+
+def add_explain_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('migrations',
+                        help='Migrations to explain, default is pending ones',
+                        nargs='*')
+    parser.add_argument('--json',
+                        help='Print estimates in JSON format',
+                        action='store_true',
+                        default=False)
+
+
+def add_refresh_arguments(parser):
+    add_verbose_argument(parser)
+    parser.add_argument('views',
+                        help='Materialized views to refresh together with '
+                             'views, depending on them, default is all',
+                        nargs='*')
+    parser.add_argument('--jobs', '-j',
+                        help='Number of views refreshed concurrently',
+                        type=int,
+                        default=4)
+    parser.add_argument('--dry-run',
+                        help='Print refresh order without refreshing',
+                        action='store_true',
+                        default=False)
+
+
+# (name, command function path, help, arguments function)
+COMMANDS = (
+    ('info',
+     'sqlibrist.commands.info:info',
+     'Print sqlibrist info',
+     add_verbose_argument),
+    ('test_connection',
+     'sqlibrist.commands.test_connection:test_connection',
+     'Test DB connection',
+     add_verbose_argument),
+    ('init',
+     'sqlibrist.commands.init:init',
+     'Init directory structure',
+     add_verbose_argument),
+    ('initdb',
+     'sqlibrist.commands.initdb:initdb',
+     'Create DB table for migrations tracking',
+     add_verbose_argument),
+    ('makemigration',
+     'sqlibrist.commands.makemigration:makemigration',
+     'Create new migration',
+     add_makemigration_arguments),
+    ('migrate',
+     'sqlibrist.commands.migrate:migrate',
+     'Apply pending migrations',
+     add_migrate_arguments),
+    ('diff',
+     'sqlibrist.commands.diff:diff',
+     'Show changes to schema',
+     add_verbose_argument),
+    ('status',
+     'sqlibrist.commands.status:status',
+     'Show unapplied migrations',
+     add_verbose_argument),
+    ('drift',
+     'sqlibrist.commands.drift:drift',
+     'Compare live DB schema with the last migration',
+     add_drift_arguments),
+    ('pack',
+     'sqlibrist.commands.pack:pack',
+     'Pack migrations into single file',
+     add_pack_arguments),
+    ('lint',
+     'sqlibrist.commands.lint:lint',
+     'Check migrations for lock and rewrite hazards',
+     add_lint_arguments),
+    ('explain',
+     'sqlibrist.commands.explain:explain',
+     'Estimate impact of pending migrations from DB statistics',
+     add_explain_arguments),
+    ('refresh',
+     'sqlibrist.commands.refresh:refresh',
+     'Refresh materialized views in dependency order',
+     add_refresh_arguments),
+    ('partitions',
+     'sqlibrist.commands.partitions:partitions',
+     'Create future and drop expired partitions of partitioned tables',
+     add_partitions_arguments),
+)
+
+
+# global options of get_command_parser, followed by value
+VALUE_OPTIONS = ('--config-file', '-f', '--config', '-c', '--pack-file')
+
+
+def get_subcommand(argv):
+    """
+    Returns first positional argument, i.e. name of requested command,
+    skipping values of global options
+    """
+    arguments = iter(argv)
+    for argument in arguments:
+        if argument in VALUE_OPTIONS:
+            next(arguments, None)
+        elif not argument.startswith('-'):
+            return argument
+    return None
+
+
+def get_command_parser(parser=None, load_plugins=True):
+    """
+    Builds argument parser for all built-in commands. Third-party commands
+    are registered with "sqlibrist.commands" entry points, each pointing to
+    function, that receives argparse subparsers object, adds own subparser
+    and sets its "func" default
+    """
     _parser = parser or argparse.ArgumentParser()
     _parser.add_argument('--config-file', '-f',
                          help='Config file, default is sqlibrist.yaml',
@@ -268,90 +922,21 @@ def get_command_parser(parser=None):
                               'default is "default"',
                          type=str,
                          default=os.environ.get('SQLIBRIST_CONFIG', 'default'))
+    _parser.add_argument('--pack-file',
+                         help='Read migrations from pack file, made by '
+                              '"pack" command',
+                         type=str,
+                         default=os.environ.get('SQLIBRIST_PACK_FILE'))
 
     subparsers = _parser.add_subparsers(parser_class=argparse.ArgumentParser)
 
-    # print info
-    print_info_parser = subparsers.add_parser('info',
-                                              help='Print sqlibrist info')
-    print_info_parser.add_argument('--verbose', '-v',
-                                   action='store_true', default=False)
-    print_info_parser.set_defaults(func=info)
-
-    # test_connection
-    test_connection_parser = subparsers.add_parser('test_connection',
-                                                   help='Test DB connection')
-    test_connection_parser.add_argument('--verbose', '-v',
-                                        action='store_true', default=False)
-    test_connection_parser.set_defaults(func=test_connection)
-
-    # init
-    init_parser = subparsers.add_parser('init',
-                                        help='Init directory structure')
-    init_parser.add_argument('--verbose', '-v',
-                             action='store_true', default=False)
-    init_parser.set_defaults(func=init)
-
-    # initdb
-    initdb_parser = subparsers.add_parser('initdb',
-                                          help='Create DB table for '
-                                               'migrations tracking')
-    initdb_parser.add_argument('--verbose', '-v',
-                               action='store_true', default=False)
-    initdb_parser.set_defaults(func=initdb)
-
-    # makemigrations
-    makemigration_parser = subparsers.add_parser('makemigration',
-                                                 help='Create new migration')
-    makemigration_parser.set_defaults(func=makemigration)
-    makemigration_parser.add_argument('--verbose', '-v',
-                                      action='store_true', default=False)
-
-    makemigration_parser.add_argument('--empty',
-                                      help='Create migration with empty up.sql '
-                                           'for manual instructions',
-                                      action='store_true',
-                                      default=False)
-    makemigration_parser.add_argument('--name', '-n',
-                                      help='Optional migration name',
-                                      type=str,
-                                      default='')
-    makemigration_parser.add_argument('--dry-run',
-                                      help='Do not save migration',
-                                      action='store_true',
-                                      default=False)
-
-    # migrate
-    migrate_parser = subparsers.add_parser('migrate',
-                                           help='Apply pending migrations')
-    migrate_parser.set_defaults(func=migrate)
-    migrate_parser.add_argument('--verbose', '-v',
-                                action='store_true', default=False)
-    migrate_parser.add_argument('--fake',
-                                help='Mark pending migrations as applied',
-                                action='store_true',
-                                default=False)
-    migrate_parser.add_argument('--dry-run',
-                                help='Do not make actual changes to the DB',
-                                action='store_true',
-                                default=False)
-    migrate_parser.add_argument('--migration', '-m',
-                                help='Apply up to given migration number',
-                                type=str)
-    migrate_parser.add_argument('--revert', '-r',
-                                help='Unapply last migration',
-                                action='store_true')
-
-    # diff
-    diff_parser = subparsers.add_parser('diff', help='Show changes to schema')
-    diff_parser.set_defaults(func=diff)
-    diff_parser.add_argument('--verbose', '-v',
-                             action='store_true', default=False)
-
-    # status
-    status_parser = subparsers.add_parser('status',
-                                          help='Show unapplied migrations')
-    status_parser.add_argument('--verbose', '-v',
-                               action='store_true', default=False)
-    status_parser.set_defaults(func=status)
+    for name, path, help_text, add_arguments in COMMANDS:
+        command_parser = subparsers.add_parser(name, help=help_text)
+        add_arguments(command_parser)
+        command_parser.set_defaults(func=LazyCommand(path))
+
+    if load_plugins:
+        for name, path in iter_entry_points(COMMANDS_ENTRY_POINT):
+            import_object(path)(subparsers)
+
     return _parser
@@ -0,0 +1,176 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import json
+import os
+import time
+
+
+class BaseHook(object):
+    """
+    Engine execution hook. Subclass and register with engine.add_hook() to
+    observe migrations. Durations and lock waits are in seconds, lock_wait
+    is None when unknown
+    """
+    def before_migration(self, engine, migration, direction):
+        pass
+
+    def after_migration(self, engine, migration, direction, duration,
+                        statements):
+        pass
+
+    def before_statement(self, engine, migration, statement):
+        pass
+
+    def after_statement(self, engine, migration, statement, duration,
+                        rowcount, lock_wait):
+        pass
+
+    def on_error(self, engine, migration, statement, error):
+        pass
+
+    def on_progress(self, engine, migration, progress):
+        """
+        Called periodically by sqlibrist.monitor.ProgressMonitor with dict
+        of state, phase, done, total, percent, eta, elapsed and blocking
+        """
+        pass
+
+
+class JsonLinesExporter(BaseHook):
+    """
+    Appends every event as JSON object to file, one per line
+    """
+    def __init__(self, filename):
+        self.filename = filename
+
+    def write(self, engine, event, **kwargs):
+        kwargs.update(event=event,
+                      time=time.time(),
+                      engine=engine.__class__.__name__,
+                      database=engine.config.get('name'))
+        if 'statement' in kwargs:
+            kwargs['statement'] = kwargs['statement'].strip()[:200]
+        if 'error' in kwargs:
+            kwargs['error'] = str(kwargs['error']).strip()
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(kwargs, sort_keys=True))
+            f.write('\n')
+
+    def before_migration(self, engine, migration, direction):
+        self.write(engine, 'before_migration',
+                   migration=migration, direction=direction)
+
+    def after_migration(self, engine, migration, direction, duration,
+                        statements):
+        self.write(engine, 'after_migration',
+                   migration=migration, direction=direction,
+                   duration=duration, statements=statements)
+
+    def before_statement(self, engine, migration, statement):
+        self.write(engine, 'before_statement',
+                   migration=migration, statement=statement)
+
+    def after_statement(self, engine, migration, statement, duration,
+                        rowcount, lock_wait):
+        self.write(engine, 'after_statement',
+                   migration=migration, statement=statement,
+                   duration=duration, rowcount=rowcount, lock_wait=lock_wait)
+
+    def on_error(self, engine, migration, statement, error):
+        self.write(engine, 'on_error',
+                   migration=migration, statement=statement, error=error)
+
+    def on_progress(self, engine, migration, progress):
+        self.write(engine, 'on_progress', migration=migration, **progress)
+
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\') \
+        .replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+class PrometheusExporter(BaseHook):
+    """
+    Writes metrics in Prometheus text format, suitable for node_exporter
+    textfile collector. File is rewritten atomically after each migration
+    and error
+    """
+    METRICS = (
+        ('sqlibrist_migration_duration_seconds', 'gauge',
+         'Duration of migration'),
+        ('sqlibrist_migration_statements_total', 'counter',
+         'Number of executed statement blocks'),
+        ('sqlibrist_migration_statement_seconds_total', 'counter',
+         'Total duration of executed statement blocks'),
+        ('sqlibrist_migration_statement_max_seconds', 'gauge',
+         'Duration of the slowest statement block'),
+        ('sqlibrist_migration_rows_total', 'counter',
+         'Number of rows, affected by statements'),
+        ('sqlibrist_migration_lock_wait_seconds_total', 'counter',
+         'Time spent waiting for locks'),
+        ('sqlibrist_migration_errors_total', 'counter',
+         'Number of failed statements'),
+        ('sqlibrist_last_run_timestamp_seconds', 'gauge',
+         'Time of the last migration'),
+    )
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.samples = dict((name, {}) for name, _, _ in self.METRICS)
+
+    def add(self, metric, labels, value, function=sum):
+        samples = self.samples[metric]
+        key = tuple(sorted(labels.items()))
+        if key in samples:
+            samples[key] = function((samples[key], value))
+        else:
+            samples[key] = value
+
+    def get_labels(self, engine, migration, **kwargs):
+        kwargs.update(database=engine.config.get('name') or '',
+                      migration=migration)
+        return kwargs
+
+    def after_migration(self, engine, migration, direction, duration,
+                        statements):
+        labels = self.get_labels(engine, migration, direction=direction)
+        self.samples['sqlibrist_migration_duration_seconds'][
+            tuple(sorted(labels.items()))] = duration
+        self.samples['sqlibrist_last_run_timestamp_seconds'][
+            (('database', labels['database']),)] = time.time()
+        self.write()
+
+    def after_statement(self, engine, migration, statement, duration,
+                        rowcount, lock_wait):
+        labels = self.get_labels(engine, migration)
+        self.add('sqlibrist_migration_statements_total', labels, 1)
+        self.add('sqlibrist_migration_statement_seconds_total',
+                 labels, duration)
+        self.add('sqlibrist_migration_statement_max_seconds',
+                 labels, duration, max)
+        if rowcount is not None and rowcount >= 0:
+            self.add('sqlibrist_migration_rows_total', labels, rowcount)
+        if lock_wait is not None:
+            self.add('sqlibrist_migration_lock_wait_seconds_total',
+                     labels, lock_wait)
+
+    def on_error(self, engine, migration, statement, error):
+        self.add('sqlibrist_migration_errors_total',
+                 self.get_labels(engine, migration), 1)
+        self.write()
+
+    def write(self):
+        temporary_filename = '%s.%s.tmp' % (self.filename, os.getpid())
+        with open(temporary_filename, 'w') as f:
+            for name, metric_type, help_text in self.METRICS:
+                f.write('# HELP %s %s\n' % (name, help_text))
+                f.write('# TYPE %s %s\n' % (name, metric_type))
+                for labels, value in sorted(self.samples[name].items()):
+                    f.write('%s{%s} %s\n' % (
+                        name,
+                        ','.join('%s="%s"' % (key, escape_label(label))
+                                 for key, label in labels),
+                        repr(float(value))))
+        os.rename(temporary_filename, self.filename)
@@ -0,0 +1,140 @@
+# -*- coding: utf8 -*-
+from __future__ import print_function
+
+import sys
+import threading
+import time
+
+from sqlibrist.hooks import BaseHook
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '%dh%02dm' % (hours, minutes)
+    elif minutes:
+        return '%dm%02ds' % (minutes, seconds)
+    return '%ds' % seconds
+
+
+class ProgressMonitor(BaseHook):
+    """
+    Polls progress of statements, executed by engine, from the second
+    connection in background thread. Renders phase, percent done, ETA and
+    blocking sessions to stderr and passes them to engine's on_progress
+    hooks. While statement waits for locks, accumulates engine.lock_wait
+    """
+    def __init__(self, engine, interval=2.0, output=sys.stderr):
+        self.engine = engine
+        self.interval = interval
+        self.output = output
+        self.monitor_engine = engine.__class__(engine.config)
+        self.backend_id = None
+        self.migration = None
+        self.statement_started = None
+        self.samples = []
+        self.rendered = False
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def before_migration(self, engine, migration, direction):
+        self.migration = migration
+        if self.thread is None:
+            self.backend_id = engine.get_backend_id()
+            self.thread = threading.Thread(target=self.run)
+            self.thread.daemon = True
+            self.thread.start()
+
+    def before_statement(self, engine, migration, statement):
+        engine.lock_wait = 0.0
+        self.samples = []
+        self.statement_started = time.time()
+
+    def after_statement(self, engine, migration, statement, duration,
+                        rowcount, lock_wait):
+        self.statement_started = None
+        self.clear()
+
+    def on_error(self, engine, migration, statement, error):
+        self.statement_started = None
+        self.clear()
+
+    def get_eta(self, progress):
+        """
+        Estimates remaining time from the rate of work in current phase
+        """
+        if not progress['total']:
+            self.samples = []
+            return None
+        sample = (time.time(), progress['phase'], progress['done'])
+        self.samples = [s for s in self.samples if s[1] == sample[1]]
+        self.samples.append(sample)
+        first = self.samples[0]
+        if sample[2] <= first[2]:
+            return None
+        rate = float(sample[2] - first[2]) / (sample[0] - first[0])
+        return (progress['total'] - sample[2]) / rate
+
+    def poll(self):
+        progress = self.monitor_engine.get_progress(self.backend_id)
+        if progress is None or self.statement_started is None:
+            return
+        if progress['waiting'] and self.engine.lock_wait is not None:
+            self.engine.lock_wait += self.interval
+
+        progress['elapsed'] = time.time() - self.statement_started
+        progress['eta'] = self.get_eta(progress)
+        if progress['total']:
+            progress['percent'] = 100.0 * progress['done'] / progress['total']
+        else:
+            progress['percent'] = None
+
+        self.engine.call_hooks('on_progress',
+                               migration=self.migration,
+                               progress=progress)
+        self.render(progress)
+
+    def render(self, progress):
+        parts = [format_duration(progress['elapsed'])]
+        if progress['phase']:
+            parts.append(progress['phase'])
+        if progress['percent'] is not None:
+            parts.append('%.1f%%' % progress['percent'])
+        if progress['eta'] is not None:
+            parts.append('ETA %s' % format_duration(progress['eta']))
+        if progress['blocking']:
+            parts.append('blocked by %s' % '; '.join(
+                str(session) for session in progress['blocking']))
+        line = '  %s: %s' % (self.migration, ', '.join(parts))
+
+        if self.output.isatty():
+            # progress line goes below "Applying migration..." line
+            self.output.write('%s\r\033[K%s' % ('' if self.rendered else '\n',
+                                                line))
+        else:
+            self.output.write('%s\n' % line)
+        self.output.flush()
+        self.rendered = True
+
+    def clear(self):
+        if self.rendered and self.output.isatty():
+            self.output.write('\r\033[K')
+            self.output.flush()
+        self.rendered = False
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.poll()
+            except Exception as e:
+                self.output.write('\nProgress monitor stopped: %s\n' % e)
+                return
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.clear()
+        if self.monitor_engine.connection is not None:
+            self.monitor_engine.connection.close()